@@ -0,0 +1,116 @@
+from functools import lru_cache
+from io import BytesIO
+
+from PIL import Image, ImageFont
+
+from utils import LRUCache
+
+FONT_PATH = "uni.ttf"
+
+# images used by the commands, decoded when the bot starts
+STATIC_IMAGES = (
+    "dumpy/black.png",
+    *(f"dumpy/{it}.png" for it in range(6)),
+    "images/sotrue.png",
+    "images/Laser.jpg",
+)
+
+# resized tiles kept for get_tile, a tile is a few KB so this holds the
+# sizes of hundreds of recent commands
+TILE_CACHE_BYTES = 8 * 2**20
+
+# images are decoded at no less than this many times the size they are
+# scaled to, so the final resize still has enough detail
+REDUCING_GAP = 2.0
+
+
+def decode_scaled(
+    img: Image.Image, size: tuple[int, int], mode: str = "RGB"
+) -> Image.Image:
+    """Decodes an opened image directly at a smaller size.
+    Jpegs are scaled down while decoding, other formats are reduced by
+    whole factors before the final resize.
+    Args:
+        img (Image.Image): Image returned by Image.open, not loaded yet.
+        size (tuple[int, int]): Size of the result.
+        mode (str): Mode of the result.
+    Returns:
+        Image.Image: The image resized to size."""
+    if img.format == "JPEG":
+        img.draft(None, (int(size[0] * REDUCING_GAP), int(size[1] * REDUCING_GAP)))
+    return img.convert(mode).resize(size, reducing_gap=REDUCING_GAP)
+
+
+def load_image(
+    imagebytes: bytes, size: tuple[int, int], mode: str = "RGB"
+) -> Image.Image:
+    """Decodes encoded image bytes at the size they will be shown at."""
+    return decode_scaled(Image.open(BytesIO(imagebytes)), size, mode)
+
+
+def get_image(
+    path: str, mode: str | None = None, size: tuple[int, int] | None = None
+) -> Image.Image:
+    """Returns a copy of a static image that is safe to draw on.
+    Args:
+        path (str): Path of the image file.
+        mode (str | None): Mode to convert the image to.
+        size (tuple[int, int] | None): Size to resize the image to.
+    Returns:
+        Image.Image: A private copy of the decoded image."""
+    img = _variant(path, mode)
+    # resized copies are not cached, the sizes depend on the user's image and
+    # would fill the cache with large one-off entries, see get_tile
+    return img.resize(size) if size is not None else img.copy()
+
+
+def _image_bytes(img: Image.Image) -> int:
+    return img.width * img.height * len(img.getbands())
+
+
+_tiles: LRUCache[tuple[str, str | None, tuple[int, int]], Image.Image] = LRUCache(
+    max_size=TILE_CACHE_BYTES, sizeof=_image_bytes
+)
+
+
+def get_tile(path: str, mode: str | None, size: tuple[int, int]) -> Image.Image:
+    """Returns a static image resized to a small size, shared between calls.
+    Tiles are cached by their size up to TILE_CACHE_BYTES, the returned image
+    must not be modified.
+    Args:
+        path (str): Path of the image file.
+        mode (str | None): Mode to convert the image to.
+        size (tuple[int, int]): Size to resize the image to.
+    Returns:
+        Image.Image: The resized image."""
+    key = (path, mode, size)
+    tile = _tiles.get(key)
+    if tile is None:
+        tile = _variant(path, mode).resize(size)
+        _tiles.put(key, tile)
+    return tile
+
+
+@lru_cache(maxsize=32)
+def _variant(path: str, mode: str | None) -> Image.Image:
+    """Decodes and converts an image, each step cached separately."""
+    if mode is not None:
+        return _variant(path, None).convert(mode)
+
+    img = Image.open(path)
+    img.load()
+    return img
+
+
+@lru_cache(maxsize=32)
+def get_font(
+    size: int, path: str = FONT_PATH, encoding: str = ""
+) -> ImageFont.FreeTypeFont:
+    """Loads a truetype font, fonts are never modified so they are shared."""
+    return ImageFont.truetype(path, size, encoding=encoding)
+
+
+def preload() -> None:
+    """Decodes every static image so no command has to read them from disk."""
+    for path in STATIC_IMAGES:
+        _variant(path, None)
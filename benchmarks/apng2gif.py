@@ -0,0 +1,83 @@
+"""Compares converting animated pngs with apnggif through temporary files
+against the in-memory converter.
+
+Pngs are read from benchmarks/fixtures/apng2gif/*.png, when there are none
+a synthetic animation with transparency is used.
+"""
+
+import argparse
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+
+from apnggif import apnggif
+from PIL import Image, ImageDraw
+
+from benchmarks.inputs import load_inputs
+from gifs import apng_to_gif
+
+
+def apnggif_convert(imagebytes: bytes) -> bytes:
+    """The conversion apng2gif used before, a png and a gif file on disk."""
+    with tempfile.TemporaryDirectory() as directory:
+        png_path = Path(directory) / "in.png"
+        gif_path = Path(directory) / "out.gif"
+        png_path.write_bytes(imagebytes)
+        apnggif(png=str(png_path), gif=str(gif_path))
+        return gif_path.read_bytes()
+
+
+def synthetic_apng(frames: int = 60, size: tuple[int, int] = (320, 240)) -> bytes:
+    """Builds a shaded bouncing ball over a transparent background."""
+    images = []
+    for ii in range(frames):
+        img = Image.new("RGBA", size, (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        x = ii * 7 % (size[0] - 60)
+        y = abs(ii * 11 % (2 * (size[1] - 60)) - (size[1] - 60))
+        for r in range(30, 0, -2):
+            shade = (255, 40 + ii * 3 % 150 + r * 2, r * 8, 255)
+            draw.ellipse((x + 30 - r, y + 30 - r, x + 30 + r, y + 30 + r), fill=shade)
+        draw.rectangle((0, size[1] - 20, size[0], size[1]), fill=(40, 120, 40, 255))
+        images.append(img)
+    with BytesIO() as png_binary:
+        images[0].save(
+            png_binary,
+            format="PNG",
+            save_all=True,
+            append_images=images[1:],
+            duration=40,
+            loop=0,
+        )
+        return png_binary.getvalue()
+
+
+def best_of(func, imagebytes: bytes, repeat: int) -> tuple[float, bytes]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        gifbytes = func(imagebytes)
+        times.append(time.perf_counter() - start)
+    return min(times), gifbytes
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pngs = load_inputs("apng2gif", ("*.png",), lambda: {"synthetic": synthetic_apng()})
+    for name, imagebytes in pngs.items():
+        old_time, old_gif = best_of(apnggif_convert, imagebytes, args.repeat)
+        new_time, new_gif = best_of(apng_to_gif, imagebytes, args.repeat)
+        frames = getattr(Image.open(BytesIO(new_gif)), "n_frames", 1)
+        print(
+            f"{name}: {frames} frames, "
+            f"apnggif {old_time * 1000:.0f} ms {len(old_gif) / 1024:.0f} KiB, "
+            f"in memory {new_time * 1000:.0f} ms {len(new_gif) / 1024:.0f} KiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
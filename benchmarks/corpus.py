@@ -0,0 +1,121 @@
+"""Synthetic inputs for the image pipeline benchmarks.
+
+Every item is generated from a fixed seed, so a corpus built on one machine
+is identical to one built on another.
+"""
+
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.scaled_decode import synthetic_photo
+
+# name: (width, height), covering small uploads, phone photos in both
+# orientations, a camera sized photo and a wide banner
+PHOTOS = {
+    "photo-640x480": (640, 480),
+    "photo-1920x1080": (1920, 1080),
+    "photo-1080x1920": (1080, 1920),
+    "photo-4000x3000": (4000, 3000),
+    "photo-3000x600": (3000, 600),
+}
+
+# name: (frames, (width, height), colors, transparent)
+GIFS = {
+    "gif-12f-256c-320x240": (12, (320, 240), 256, False),
+    "gif-60f-64c-480x270": (60, (480, 270), 64, False),
+    "gif-150f-16c-240x240": (150, (240, 240), 16, False),
+    "gif-40f-alpha-300x300": (40, (300, 300), 32, True),
+}
+
+TEXTS = {
+    "text-short": "Bob",
+    "text-long": "Maximilian Alexander",
+    "text-unicode": "Zoë Åsa Ñandú",
+}
+
+# name: number of slices
+CHARTS = {"chart-3": 3, "chart-12": 12, "chart-50": 50}
+
+
+def photo(size: tuple[int, int]) -> bytes:
+    with BytesIO() as image_binary:
+        synthetic_photo(size).save(image_binary, "JPEG", quality=90)
+        return image_binary.getvalue()
+
+
+def animation(
+    frames: int, size: tuple[int, int], colors: int, transparent: bool
+) -> bytes:
+    """A gradient scrolling under a bouncing square, every frame quantized to
+    the same palette of colors, with a transparent hole moving across the
+    frames if transparent."""
+    width, height = size
+    base = np.asarray(synthetic_photo((width * 2, height))).copy()
+    base[:40, :40] = (255, 255, 255)
+    opaque_colors = colors - 1 if transparent else colors
+    palette_data = (Image.fromarray(base).quantize(opaque_colors).getpalette() or [])[
+        : opaque_colors * 3
+    ]
+    palette = Image.new("P", (1, 1))
+    palette.putpalette(palette_data)
+
+    yy, xx = np.mgrid[0:height, 0:width]
+    images = []
+    for ii in range(frames):
+        shift = ii * width // frames
+        pixels = base[:, shift : shift + width].copy()
+        x = ii * 9 % (width - 40)
+        y = abs(ii * 5 % (2 * (height - 40)) - (height - 40))
+        pixels[y : y + 40, x : x + 40] = (255, 255, 255)
+        img = Image.fromarray(pixels).quantize(
+            palette=palette, dither=Image.Dither.NONE
+        )
+        if transparent:
+            data = np.asarray(img).copy()
+            hole = (xx - (width - 1 - x)) ** 2 + (yy - (height - 1 - y)) ** 2
+            data[hole < 30**2] = opaque_colors
+            img = Image.fromarray(data, "P")
+            img.putpalette(palette_data + [0, 0, 0])
+        images.append(img)
+
+    params = {"transparency": opaque_colors, "disposal": 2} if transparent else {}
+    with BytesIO() as gif_binary:
+        images[0].save(
+            gif_binary,
+            format="GIF",
+            save_all=True,
+            append_images=images[1:],
+            duration=40,
+            loop=0,
+            **params,
+        )
+        return gif_binary.getvalue()
+
+
+def chart(slices: int) -> tuple[list[str], list[float]]:
+    rng = np.random.default_rng(slices)
+    labels = [f"slice {ii}" for ii in range(slices)]
+    return labels, [float(value) for value in rng.integers(1, 100, slices)]
+
+
+def build(names: set[str] | None = None) -> dict[str, object]:
+    """Generates the corpus items in names, or all of them.
+    Returns:
+        dict[str, object]: Encoded images as bytes, texts as str and chart
+        data as (labels, values)."""
+    corpus: dict[str, object] = {}
+    for name, size in PHOTOS.items():
+        if names is None or name in names:
+            corpus[name] = photo(size)
+    for name, params in GIFS.items():
+        if names is None or name in names:
+            corpus[name] = animation(*params)
+    for name, text in TEXTS.items():
+        if names is None or name in names:
+            corpus[name] = text
+    for name, slices in CHARTS.items():
+        if names is None or name in names:
+            corpus[name] = chart(slices)
+    return corpus
@@ -0,0 +1,36 @@
+"""Inputs of the benchmarks, read from benchmarks/fixtures/<benchmark>.
+
+Each benchmark has its own directory, so files saved for one are not picked
+up by another. Benchmarks fall back to synthetic inputs when theirs is empty.
+"""
+
+from collections.abc import Callable
+from pathlib import Path
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def fixture_dir(benchmark: str) -> Path:
+    """Returns the directory of the saved inputs of a benchmark."""
+    return FIXTURES / benchmark
+
+
+def load_inputs(
+    benchmark: str,
+    patterns: tuple[str, ...],
+    synthetic: Callable[[], dict[str, bytes]],
+) -> dict[str, bytes]:
+    """Reads the saved inputs of a benchmark.
+    Args:
+        benchmark (str): Name of the benchmark, its directory in fixtures.
+        patterns (tuple[str, ...]): Glob patterns of the input files.
+        synthetic (Callable[[], dict[str, bytes]]): Builds the inputs used
+            when no file matches.
+    Returns:
+        dict[str, bytes]: The inputs by name."""
+    inputs = {
+        path.name: path.read_bytes()
+        for pattern in patterns
+        for path in sorted(fixture_dir(benchmark).glob(pattern))
+    }
+    return inputs or synthetic()
@@ -0,0 +1,119 @@
+"""Compares building the full tree of know your meme search pages with
+BeautifulSoup against tokenizing them for the result links only.
+
+Pages saved from know your meme are read from
+benchmarks/fixtures/kym/search_*.html, save one with
+    python -m benchmarks.kym_parser --save "query"
+When none were saved, the synthetic pages are used: the hand built
+fixtures/kym/synthetic_*.html and a generated page with the same structure.
+"""
+
+import argparse
+import asyncio
+import random
+import timeit
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+from benchmarks.inputs import fixture_dir, load_inputs
+from kym import KYM_URL, is_result_link, normalize_query, parse_search_page
+
+
+def parse_full_page(html: bytes | str) -> list[str]:
+    """The parser kym used before, builds the tree of the whole page."""
+    soup = BeautifulSoup(html, "html.parser")
+    links = [
+        f"{KYM_URL}{link.get('href', '')}"
+        for link in soup.find_all("a")
+        if is_result_link(link.get("href", ""), link.get("class", []))
+    ]
+    return list(dict.fromkeys(links))
+
+
+def synthetic_search_page(results: int = 48, seed: int = 0) -> str:
+    """Builds a page shaped like a search page: navigation, scripts, result
+    cards with several links each and a footer."""
+    rng = random.Random(seed)
+    words = ["cat", "dog", "doge", "drake", "pepe", "wojak", "stonks", "troll"]
+    nav = "".join(
+        f'<li><a href="/categories/{w}" class="nav-link">{w}</a></li>' for w in words
+    )
+    script = "<script>" + "var x = 1;" * 2000 + "</script>"
+    cards = []
+    for ii in range(results):
+        slug = "-".join(rng.choices(words, k=3)) + f"-{ii}"
+        cards.append(
+            f'<div class="entry"><a href="/memes/{slug}" class="item">'
+            f'<img src="https://i.kym-cdn.com/{slug}.jpg" alt="{slug}"></a>'
+            f'<h2><a href="/memes/{slug}">{slug}</a></h2>'
+            f'<p>{" ".join(rng.choices(words, k=60))}</p>'
+            f'<a href="/memes/{slug}/photos" class="item">photos</a>'
+            f'<a href="/users/{rng.choice(words)}">author</a></div>'
+        )
+    footer = "".join(f'<a href="/pages/{w}">{w}</a>' for w in words * 10)
+    return (
+        f"<html><head><title>search</title>{script}</head><body>"
+        f'<nav><ul>{nav}</ul></nav><div id="results">{"".join(cards)}</div>'
+        f"<footer>{footer}</footer></body></html>"
+    )
+
+
+def synthetic_pages() -> dict[str, bytes]:
+    pages = {
+        path.name: path.read_bytes()
+        for path in sorted(fixture_dir("kym").glob("synthetic_*.html"))
+    }
+    pages["synthetic"] = synthetic_search_page().encode()
+    return pages
+
+
+def load_pages() -> dict[str, bytes]:
+    return load_inputs("kym", ("search_*.html",), synthetic_pages)
+
+
+async def save_page(query: str) -> Path:
+    from httpclient import http_client
+    from kym import HEADERS
+
+    key = normalize_query(query)
+    await http_client.start()
+    try:
+        resp = await http_client.get(
+            f"{KYM_URL}/search", params={"q": key}, headers=HEADERS
+        )
+    finally:
+        await http_client.close()
+    resp.raise_for_status()
+    fixture_dir("kym").mkdir(parents=True, exist_ok=True)
+    path = fixture_dir("kym") / f"search_{key.replace(' ', '_')}.html"
+    path.write_bytes(resp.content)
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--save", metavar="QUERY", help="save a live search page")
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.save:
+        print(f"saved {asyncio.run(save_page(args.save))}")
+        return
+
+    for name, html in load_pages().items():
+        assert parse_search_page(html) == parse_full_page(html)
+        full = min(timeit.repeat(lambda: parse_full_page(html), number=args.number))
+        strained = min(
+            timeit.repeat(lambda: parse_search_page(html), number=args.number)
+        )
+        print(
+            f"{name}: {len(html) / 1024:.0f} KiB, "
+            f"full {full / args.number * 1000:.2f} ms, "
+            f"tokenized {strained / args.number * 1000:.2f} ms, "
+            f"{full / strained:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
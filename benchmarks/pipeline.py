@@ -0,0 +1,358 @@
+"""Benchmarks the image pipeline on a synthetic corpus, offline.
+
+Each case runs on every corpus item it applies to in a fresh process, so
+the peak memory of one case doesn't hide another. The first run of a case
+warms it up and is not timed. Run from the repository root, the commands
+load their templates and font from there. Cases whose files are missing,
+like uni.ttf which is not part of the repository, are skipped:
+
+    python -m benchmarks.pipeline --save benchmarks/baseline.json
+    python -m benchmarks.pipeline --compare benchmarks/baseline.json
+
+With --compare the exit status is 1 when any case is slower or uses more
+memory than the baseline by more than --threshold. Baselines are only
+comparable on the machine they were recorded on.
+"""
+
+import argparse
+import json
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import PIL
+from attrs import define
+
+from assets import FONT_PATH
+from benchmarks import corpus
+
+DUMPY_LINES = 20
+# differences smaller than these are noise, whatever the ratio
+MIN_TIME_MS = 1.0
+MIN_MEMORY_MIB = 2.0
+
+
+def run_dumpy(imagebytes: bytes) -> object:
+    from dumpy import dumpy
+
+    return dumpy(imagebytes, DUMPY_LINES)
+
+
+def check_dumpy(imagebytes: bytes) -> bool:
+    """The vectorized renderer has to match the per pixel one exactly."""
+    from dumpy import dumpy, dumpy_reference
+
+    frames = dumpy(imagebytes, DUMPY_LINES)
+    reference = dumpy_reference(imagebytes, DUMPY_LINES)
+    return all(
+        np.array_equal(np.asarray(a), np.asarray(b.convert("RGB")))
+        for a, b in zip(frames, reference, strict=True)
+    )
+
+
+def run_shader(imagebytes: bytes) -> object:
+    """shader() on every pixel of a dumpy grid, what dumpy did per frame
+    before the lookup table."""
+    from dumpy import TILE_COUNT, _prepare, shader
+
+    _, inputimage, moguses, _ = _prepare(imagebytes, DUMPY_LINES)
+    pixels = inputimage.getdata()
+    return [shader(moguses[ii % TILE_COUNT], pixel) for ii, pixel in enumerate(pixels)]
+
+
+def setup_random_frame() -> None:
+    """Keeps the frame indexes of the benchmark out of the bot's cache."""
+    import gifs
+
+    gifs.frame_indexes.directory = Path(tempfile.mkdtemp())
+
+
+def run_random_frame(imgbytes: bytes) -> object:
+    """Rerolls a gif, indexed by the untimed first run."""
+    from gifs import random_frame
+
+    return random_frame(imgbytes, reroll=True)
+
+
+def run_random_frame_first(imgbytes: bytes) -> object:
+    """Picks a frame of a gif that was not indexed, like /giframe does."""
+    from gifs import random_frame
+
+    return random_frame(imgbytes)
+
+
+def run_random_frame_cold(imgbytes: bytes) -> object:
+    """Indexes a gif and picks a frame, like the first reroll does."""
+    from gifs import FrameIndexCache
+
+    with tempfile.TemporaryDirectory() as directory:
+        with FrameIndexCache(directory).open(imgbytes) as index:
+            return index.frame(len(index) // 2)
+
+
+def run_reverse(imgbytes: bytes) -> object:
+    from render import reversegif_job
+
+    return reversegif_job(imgbytes)
+
+
+def run_grid(imagebytes: bytes) -> object:
+    from render import grid_job, grid_tile_job
+
+    tiles: list[bytes | None] = [
+        grid_tile_job(imagebytes, number) for number in range(1, 10)
+    ]
+    return grid_job("benchmark", tiles)
+
+
+def run_birthday(text: str) -> object:
+    from render import birthday_job
+
+    return birthday_job(text)
+
+
+def run_piechart(data: tuple[list[str], list[float]]) -> object:
+    from render import chart_job
+
+    labels, values = data
+    return chart_job("pie", labels, values, "benchmark")
+
+
+@define
+class Case:
+    run: Callable[[Any], object]
+    inputs: tuple[str, ...]
+    setup: Callable[[], None] | None = None
+    check: Callable[[Any], bool] | None = None
+    # files the case loads, relative to the repository root
+    needs: tuple[str, ...] = ()
+
+
+SMALL_PHOTOS = ("photo-640x480", "photo-1080x1920", "photo-3000x600")
+ALL_GIFS = tuple(corpus.GIFS)
+
+CASES = {
+    "dumpy": Case(run_dumpy, (*corpus.PHOTOS, ALL_GIFS[0]), check=check_dumpy),
+    "shader": Case(run_shader, SMALL_PHOTOS),
+    "random_frame": Case(run_random_frame, ALL_GIFS, setup=setup_random_frame),
+    "random_frame_first": Case(
+        run_random_frame_first, ALL_GIFS, setup=setup_random_frame
+    ),
+    "random_frame_cold": Case(run_random_frame_cold, ALL_GIFS),
+    "reverse": Case(run_reverse, ALL_GIFS),
+    "grid": Case(
+        run_grid,
+        ("photo-640x480", "photo-1920x1080", "photo-4000x3000"),
+        needs=(FONT_PATH,),
+    ),
+    "birthday": Case(run_birthday, tuple(corpus.TEXTS), needs=(FONT_PATH,)),
+    "piechart": Case(run_piechart, tuple(corpus.CHARTS)),
+}
+
+
+def _proc_status_mib(field: str) -> float | None:
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss() -> float:
+    """Resets the peak resident memory of the process where linux allows it.
+    A spawned process otherwise starts with the peak of its parent, which
+    survives exec.
+    Returns:
+        float: The resident memory in MiB the peak is measured from."""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+    return _proc_status_mib("VmRSS") or peak_rss_mib()
+
+
+def peak_rss_mib() -> float:
+    peak = _proc_status_mib("VmHWM")
+    if peak is not None:
+        return peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+@define
+class Result:
+    median_ms: float
+    min_ms: float
+    peak_mib: float
+    parity: bool | None = None
+
+
+def measure(case_name: str, item: object, repeat: int) -> Result:
+    """Runs one case on one item, in the fresh process it is called in."""
+    case = CASES[case_name]
+    if case.setup is not None:
+        case.setup()
+    before = reset_peak_rss()
+    case.run(item)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        case.run(item)
+        times.append((time.perf_counter() - start) * 1000)
+    peak = peak_rss_mib() - before
+    # checked after measuring, the reference renderers use more memory
+    parity = case.check(item) if case.check is not None else None
+    return Result(statistics.median(times), min(times), peak, parity)
+
+
+def run_suite(case_names: list[str], repeat: int) -> dict[str, Result | None]:
+    """Runs every item of the cases, each in a fresh process.
+    Returns:
+        dict[str, Result | None]: The results by case and item, None for the
+        items that failed. Skipped cases are left out."""
+    runnable = []
+    for case_name in case_names:
+        missing = [path for path in CASES[case_name].needs if not Path(path).exists()]
+        if missing:
+            print(f"{case_name}: skipped, missing {', '.join(missing)}")
+        else:
+            runnable.append(case_name)
+
+    names = {name for case in runnable for name in CASES[case].inputs}
+    items = corpus.build(names)
+    results: dict[str, Result | None] = {}
+    for case_name in runnable:
+        for item_name in CASES[case_name].inputs:
+            key = f"{case_name}/{item_name}"
+            try:
+                with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+                    future = pool.submit(measure, case_name, items[item_name], repeat)
+                    result = future.result()
+            except Exception as e:
+                # one broken case doesn't stop the others
+                print(f"{key:45} failed: {e!r}")
+                results[key] = None
+                continue
+            results[key] = result
+            parity = "" if result.parity is None else f"  parity {result.parity}"
+            print(
+                f"{key:45} median {result.median_ms:9.1f} ms  "
+                f"min {result.min_ms:9.1f} ms  peak {result.peak_mib:7.1f} MiB{parity}"
+            )
+    return results
+
+
+def compare(
+    results: dict[str, Result | None], baseline: dict[str, dict], threshold: float
+) -> list[str]:
+    """Lists the cases that got slower or use more memory than the baseline
+    by more than threshold, as a fraction of the baseline."""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None or result is None:
+            continue
+        for metric, unit, minimum in (
+            # the best time is the least noisy
+            ("min_ms", "ms", MIN_TIME_MS),
+            ("peak_mib", "MiB", MIN_MEMORY_MIB),
+        ):
+            new, old = getattr(result, metric), base[metric]
+            if new > old * (1 + threshold) and new - old > minimum:
+                regressions.append(
+                    f"{key}: {metric} {old:.1f} -> {new:.1f} {unit} "
+                    f"(+{(new / old - 1) * 100 if old else float('inf'):.0f}%)"
+                )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--cases", default=",".join(CASES), help="comma separated cases to run"
+    )
+    parser.add_argument("--save", type=Path, help="write the results as a baseline")
+    parser.add_argument("--compare", type=Path, help="baseline to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="allowed slowdown or memory growth, 0.25 is 25%%",
+    )
+    args = parser.parse_args()
+
+    case_names = args.cases.split(",")
+    unknown = [name for name in case_names if name not in CASES]
+    if unknown:
+        parser.error(
+            f"unknown cases {', '.join(unknown)}, choose from {', '.join(CASES)}"
+        )
+    if args.compare and not args.compare.exists():
+        parser.error(
+            f"no baseline at {args.compare}, record one first with --save {args.compare}"
+        )
+
+    results = run_suite(case_names, args.repeat)
+    failed = False
+
+    for key, result in results.items():
+        if result is None:
+            print(f"{key}: failed to run")
+            failed = True
+        elif result.parity is False:
+            print(f"{key}: output differs from the reference renderer")
+            failed = True
+
+    if args.save:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        baseline = {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "repeat": args.repeat,
+            "results": {
+                key: {
+                    "median_ms": result.median_ms,
+                    "min_ms": result.min_ms,
+                    "peak_mib": result.peak_mib,
+                }
+                for key, result in results.items()
+                if result is not None
+            },
+        }
+        args.save.write_text(json.dumps(baseline, indent=2))
+        print(f"saved baseline to {args.save}")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        regressions = compare(results, baseline["results"], args.threshold)
+        for regression in regressions:
+            print(f"regression {regression}")
+        if regressions:
+            failed = True
+        else:
+            print(f"no regressions above {args.threshold:.0%} against {args.compare}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Compares decoding uploads at full resolution and then resizing them with
+decoding them at the size the commands use.
+
+Uses the photos in benchmarks/fixtures/scaled_decode/*.jpg and *.png, or a
+synthetic 4000x3000 photo saved as jpeg and png when there are none.
+"""
+
+import argparse
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from assets import REDUCING_GAP, decode_scaled
+from benchmarks.inputs import load_inputs
+
+# sizes the commands scale uploads to
+TARGETS = {
+    "sotrue": (246, 245),
+    "grid": (300, 300),
+    "dumpy": (26, 30),
+}
+
+
+def synthetic_photo(size: tuple[int, int] = (4000, 3000)) -> Image.Image:
+    """Smooth gradients with some noise, compresses like a photo."""
+    width, height = size
+    x = np.linspace(0, 1, width, dtype=np.float32)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    rng = np.random.default_rng(0)
+    channels = [
+        255 * (0.5 + 0.5 * np.sin(6 * x + 3 * y)),
+        255 * (0.5 + 0.5 * np.cos(4 * x * y + 2 * x)),
+        255 * y.repeat(width, axis=1),
+    ]
+    pixels = np.stack(channels, axis=-1)
+    pixels += rng.normal(0, 6, pixels.shape).astype(np.float32)
+    return Image.fromarray(pixels.clip(0, 255).astype(np.uint8))
+
+
+def synthetic_images() -> dict[str, bytes]:
+    photo = synthetic_photo()
+    images = {}
+    for image_format in ("JPEG", "PNG"):
+        with BytesIO() as image_binary:
+            photo.save(image_binary, image_format)
+            images[f"synthetic.{image_format.lower()}"] = image_binary.getvalue()
+    return images
+
+
+def load_images() -> dict[str, bytes]:
+    return load_inputs("scaled_decode", ("*.jpg", "*.png"), synthetic_images)
+
+
+def full_decode(imagebytes: bytes, size: tuple[int, int]) -> Image.Image:
+    """How the commands loaded uploads before."""
+    return Image.open(BytesIO(imagebytes)).convert("RGB").resize(size)
+
+
+def scaled_decode(imagebytes: bytes, size: tuple[int, int]) -> Image.Image:
+    return decode_scaled(Image.open(BytesIO(imagebytes)), size)
+
+
+def decoded_bytes(imagebytes: bytes, size: tuple[int, int], scaled: bool) -> int:
+    """Size of the pixel buffer the decoder produces."""
+    img = Image.open(BytesIO(imagebytes))
+    if scaled and img.format == "JPEG":
+        img.draft(None, (int(size[0] * REDUCING_GAP), int(size[1] * REDUCING_GAP)))
+    img.load()
+    return img.width * img.height * len(img.getbands())
+
+
+def best_time(func, imagebytes: bytes, size: tuple[int, int], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(imagebytes, size)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for name, imagebytes in load_images().items():
+        for command, size in TARGETS.items():
+            full_time = best_time(full_decode, imagebytes, size, args.repeat)
+            new_time = best_time(scaled_decode, imagebytes, size, args.repeat)
+            full_bytes = decoded_bytes(imagebytes, size, scaled=False)
+            new_bytes = decoded_bytes(imagebytes, size, scaled=True)
+            print(
+                f"{name} -> {command} {size[0]}x{size[1]}: "
+                f"full {full_time * 1000:.0f} ms {full_bytes / 2**20:.1f} MiB, "
+                f"scaled {new_time * 1000:.0f} ms {new_bytes / 2**20:.1f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,46 @@
 # bot.py
 import asyncio
 import glob
-import tempfile
 import traceback
 from io import BytesIO
 from pathlib import Path
 from typing import cast
 
 import discord
-import httpx
-import matplotlib.pyplot as plt
 import nest_asyncio
-import numpy as np
-from bs4 import BeautifulSoup
 from discord import Emoji, app_commands
 from discord.ext import commands
 from dotenv import load_dotenv
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
 
+from charts import parse_chart
+from commandsync import command_sync
 from config import parse_cli_args, read_configs
-from decorators import log_arguments, timer_function
-from dumpy import dumpy
-from image_handler import FileImage, create_image_class
+from decorators import command_profiler, log_arguments, memoize, timer_function
+from httpclient import http_client
+from image_handler import MB, FileImage, create_image_class, download
+from kym import kym_search
 from layoutviews import EditView, ScrollerV2
-from utils import clean_str, memerequest
+from metrics import MetricsServer, phase, registry, set_outcome
+from render import (
+    RenderExecutor,
+    amogus_job,
+    birthday_job,
+    caption_job,
+    chart_job,
+    grid_job,
+    grid_tile_job,
+    sotrue_job,
+)
+from rendercache import render_cache
+from startup import startup_timeline
+from templatecatalog import CompletionCache, template_catalog
+from tracing import SpanWriter
+from utils import clean_str, with_format_suffix
 from views import Scroller
 
+startup_timeline.mark("imports")
+
 load_dotenv()
 
 nest_asyncio.apply()
@@ -35,22 +50,89 @@ args = parse_cli_args()
 configs = read_configs(prod=args.prod)
 TOKEN: str = configs.token
 MY_GUILDS: list[discord.Object] = configs.guilds
+startup_timeline.mark("config")
+# seconds to download one image of /grid
+GRID_TILE_TIMEOUT = 15
 
 
 class DiscordClient(commands.Bot):
     def __init__(self):
         super().__init__(intents=discord.Intents.default(), command_prefix="$")
+        self.render = RenderExecutor(configs.render)
+        self.http_client = http_client
+        self.metrics_server = MetricsServer(
+            configs.metrics.host, configs.metrics.port, registry.expose
+        )
+        self.span_writer = SpanWriter()
+        self.background_tasks: list[asyncio.Task] = []
+        self.warm_up_task: asyncio.Task | None = None
 
     async def setup_hook(self):
-        for file in glob.glob("cogs/*.py"):
-            await client.load_extension(file.replace("/", ".")[:-3])
-        for MY_GUILD in MY_GUILDS:
-            self.tree.copy_global_to(guild=MY_GUILD)
-            await self.tree.sync(guild=MY_GUILD)
+        self.span_writer.start()
+        with startup_timeline.phase("http client"):
+            await self.http_client.start()
+        if configs.metrics.port:
+            await self.metrics_server.start()
+        with startup_timeline.phase("template catalog"):
+            await asyncio.to_thread(template_catalog.load)
+        self.background_tasks.append(
+            asyncio.create_task(template_catalog.refresh_forever())
+        )
+        with startup_timeline.phase("cogs"):
+            for file in glob.glob("cogs/*.py"):
+                await client.load_extension(file.replace("/", ".")[:-3])
+        # commands are profiled and counted by the name they have in discord
+        command_profiler.commands.update(
+            command.qualified_name
+            for command in self.tree.walk_commands()
+            if command.name != "profile"
+        )
+        command_profiler.commands.update(
+            menu.name
+            for kind in (discord.AppCommandType.message, discord.AppCommandType.user)
+            for menu in self.tree.get_commands(type=kind)
+        )
+        with startup_timeline.phase("command sync"):
+            synced = await command_sync.sync(
+                self.tree, MY_GUILDS, force=args.force_sync
+            )
+            print(f"Synced commands to {len(synced)} of {len(MY_GUILDS)} guilds")
+
+    async def warm_up(self):
+        """Loads what the commands use in the background once the bot is
+        connected, so neither startup nor the first command waits for it."""
+        try:
+            with startup_timeline.phase("warm-up imports"):
+                await asyncio.to_thread(warm_up_imports)
+            with startup_timeline.phase("warm-up render workers"):
+                await self.render.warm_up()
+        except Exception as e:
+            print(e)
+            print(traceback.format_exc())
+        print(startup_timeline.report())
+
+    async def close(self):
+        for task in self.background_tasks:
+            task.cancel()
+        self.render.shutdown()
+        await self.metrics_server.close()
+        self.span_writer.stop()
+        await self.http_client.close()
+        await super().close()
+
+
+def warm_up_imports():
+    """Imports numpy, which /over loads lazily, and primes Pillow's plugins.
+    The shader table is built here on the first run, before the render
+    workers memory map it."""
+    from dumpy import load_shader_lut
+
+    Image.init()
+    load_shader_lut()
 
 
 client = DiscordClient()
-httpClient = httpx.Client(timeout=120)
+template_completions = CompletionCache()
 
 
 @client.event
@@ -59,6 +141,46 @@ async def on_ready():
     if user is not None:
         print(f"Logged in as {user} (ID: {user.id})")
         print("------")
+    if client.warm_up_task is None:
+        startup_timeline.mark("gateway connect")
+        client.warm_up_task = asyncio.create_task(client.warm_up())
+        client.background_tasks.append(client.warm_up_task)
+
+
+@client.tree.command(
+    name="profile", description="Profiles the next runs of a command (owner only)"
+)
+@app_commands.describe(
+    command="name of the command", invocations="number of runs to profile"
+)
+@log_arguments
+async def profile(
+    ctx: discord.Interaction,
+    command: str,
+    invocations: app_commands.Range[int, 1, 20] = 1,
+):
+    if not await client.is_owner(ctx.user):
+        await ctx.response.send_message(
+            "Only the owner of the bot can profile commands", ephemeral=True
+        )
+        return
+    if command not in command_profiler.commands:
+        await ctx.response.send_message(f"Unknown command {command}", ephemeral=True)
+        return
+    command_profiler.enable(command, invocations)
+    await ctx.response.send_message(
+        f"Profiling the next {invocations} runs of {command}, "
+        f"stats are saved in {command_profiler.directory}",
+        ephemeral=True,
+    )
+
+
+@profile.autocomplete("command")
+async def profile_command_autocomplete(
+    ctx: discord.Interaction, current: str
+) -> list[app_commands.Choice[str]]:
+    names = sorted(name for name in command_profiler.commands if current in name)
+    return [app_commands.Choice(name=name, value=name) for name in names[:25]]
 
 
 @client.tree.context_menu(name="StickerInfo")
@@ -82,6 +204,7 @@ async def stickerinfo(ctx: discord.Interaction, message: discord.Message):
         view = view.add_item(container)
         await ctx.response.send_message(view=view)
     except Exception as e:
+        set_outcome("error")
         print(e)
         print(traceback.format_exc())
         await ctx.response.send_message("Error finding sticker", ephemeral=True)
@@ -91,6 +214,8 @@ async def stickerinfo(ctx: discord.Interaction, message: discord.Message):
 @log_arguments
 @timer_function
 async def react_over(ctx: discord.Interaction, message: discord.Message):
+    import numpy as np
+
     await ctx.response.defer()
     try:
         over_emotes = np.array(
@@ -156,6 +281,7 @@ async def react_over(ctx: discord.Interaction, message: discord.Message):
         await ctx.delete_original_response()
 
     except Exception as e:
+        set_outcome("error")
         print(e)
         print(traceback.format_exc())
         await ctx.followup.send("Error reacting to message", ephemeral=True)
@@ -163,6 +289,34 @@ async def react_over(ctx: discord.Interaction, message: discord.Message):
         await ctx.delete_original_response()
 
 
+async def send_chart(
+    ctx: discord.Interaction, kind: str, labels: str, values: str, title: str
+):
+    """Renders a chart in the render pool and sends it as a png."""
+    await ctx.response.defer()
+    try:
+        labelslst, valueslst = parse_chart(labels, values)
+        imagebytes = await client.render.submit(
+            chart_job, kind, labelslst, valueslst, title
+        )
+        filename = f"{clean_str(title)}.png"
+
+        with phase("upload"):
+            await ctx.followup.send(
+                file=discord.File(fp=BytesIO(imagebytes), filename=filename)
+            )
+
+    except ValueError as e:
+        set_outcome("invalid")
+        await ctx.followup.send(str(e))
+
+    except Exception as e:
+        set_outcome("error")
+        print(e)
+        print(traceback.format_exc())
+        await ctx.followup.send(f"Error creating {kind} chart")
+
+
 @client.tree.command(name="piechart", description="Creates a pie chart")
 @app_commands.describe(
     labels="labels seperated by ,",
@@ -171,28 +325,35 @@ async def react_over(ctx: discord.Interaction, message: discord.Message):
 )
 @log_arguments
 @timer_function
+@memoize()
 async def piechart(ctx: discord.Interaction, labels: str, values: str, title: str):
-    try:
-        labelslst = labels.split(",")
-        valueslst = values.split(",")
-        # write code for a pie chart using matplotlib
-        fig, ax = plt.subplots()
-        ax.pie(valueslst)
-        plt.title(title)
-        plt.legend(labels=labelslst, loc="best", bbox_to_anchor=(1, 0.85))
-        filename = f"{clean_str(title)}.png"
+    await send_chart(ctx, "pie", labels, values, title)
 
-        with tempfile.NamedTemporaryFile(suffix=".png") as fp:
-            plt.savefig(fp.name, bbox_inches="tight")
 
-            await ctx.response.send_message(
-                file=discord.File(fp=fp.name, filename=filename)
-            )
+@client.tree.command(name="barchart", description="Creates a bar chart")
+@app_commands.describe(
+    labels="labels seperated by ,",
+    values="chart values seperated by ,",
+    title="title of chart",
+)
+@log_arguments
+@timer_function
+@memoize()
+async def barchart(ctx: discord.Interaction, labels: str, values: str, title: str):
+    await send_chart(ctx, "bar", labels, values, title)
 
-    except Exception as e:
-        print(e)
-        print(traceback.format_exc())
-        await ctx.response.send_message("Error creating pie chart")
+
+@client.tree.command(name="linechart", description="Creates a line chart")
+@app_commands.describe(
+    labels="labels seperated by ,",
+    values="chart values seperated by ,",
+    title="title of chart",
+)
+@log_arguments
+@timer_function
+@memoize()
+async def linechart(ctx: discord.Interaction, labels: str, values: str, title: str):
+    await send_chart(ctx, "line", labels, values, title)
 
 
 @client.tree.command(name="sotrue", description="Creates a so true meme")
@@ -201,31 +362,28 @@ async def piechart(ctx: discord.Interaction, labels: str, values: str, title: st
 )
 @log_arguments
 @timer_function
+@memoize()
 async def sotrue(ctx: discord.Interaction, file: discord.Attachment):
     await ctx.response.defer()
     try:
-        file_img = FileImage(file=file, filetype="image")
+        file_img = FileImage(file=file, filetype="image", max_bytes=10 * MB)
         image_bytes = await file_img.get_image_bytes()
         filename = str(Path(file_img.get_filename()).with_suffix(".png"))
 
-        img = Image.open("images/sotrue.png")
-
-        img2 = Image.open(BytesIO(image_bytes))
-        img2 = img2.resize((img.size[0] // 2 - 5, img.size[1] // 2 - 5))
-        img.paste(img2, (img.size[0] // 2 + 2, img.size[1] // 2 + 2))
+        imagebytes = await client.render.submit(sotrue_job, image_bytes)
 
         # send final image
-        with BytesIO() as image_binary:
-            img.save(image_binary, "PNG")
-            image_binary.seek(0)
+        with phase("upload"):
             await ctx.followup.send(
-                file=discord.File(fp=image_binary, filename=filename)
+                file=discord.File(fp=BytesIO(imagebytes), filename=filename)
             )
     except ValueError as v:
+        set_outcome("invalid")
         print(v)
         await ctx.followup.send(str(v), ephemeral=True)
         return
     except Exception as e:
+        set_outcome("error")
         print(e)
         print(traceback.format_exc())
         await ctx.followup.send("Error adding text to image", ephemeral=True)
@@ -237,6 +395,7 @@ async def sotrue(ctx: discord.Interaction, file: discord.Attachment):
 )
 @log_arguments
 @timer_function
+@memoize()
 async def amogus(
     ctx: discord.Interaction,
     file: discord.Attachment | None = None,
@@ -245,30 +404,23 @@ async def amogus(
 ):
     await ctx.response.defer()
     try:
-        img = await create_image_class(file, link, "image")
+        img = await create_image_class(file, link, "image", max_bytes=10 * MB)
         imagebytes = await img.get_image_bytes()
         filename = str(Path(img.get_filename()).with_suffix(".gif"))
 
-        frames = dumpy(imagebytes, lines)
-        frame_one = frames[0]
-        with BytesIO() as gif_binary:
-            frame_one.save(
-                gif_binary,
-                format="GIF",
-                append_images=frames,
-                save_all=True,
-                duration=100,
-                loop=0,
-                disposal=2,
+        gifbytes = await client.render.submit(amogus_job, imagebytes, lines)
+        with phase("upload"):
+            await ctx.followup.send(
+                file=discord.File(fp=BytesIO(gifbytes), filename=filename)
             )
-            gif_binary.seek(0)
-            await ctx.followup.send(file=discord.File(fp=gif_binary, filename=filename))
     except ValueError as v:
+        set_outcome("invalid")
         print(v)
         await ctx.followup.send(str(v), ephemeral=True)
         return
 
     except Exception as e:
+        set_outcome("error")
         print(e)
         print(traceback.format_exc())
         await ctx.followup.send("Error creating amogus gif", ephemeral=True)
@@ -291,23 +443,29 @@ async def creatememe(
     await ctx.response.defer()
     try:
         img = await create_image_class(file, link, "image")
-        url = img.get_url()
         filename = img.get_filename()
+        background = await img.get_image_bytes()
 
-        imagebytes = await memerequest(url, text)
-        view = EditView(url, filename, imagebytes)
-        msg = await ctx.followup.send(
-            file=discord.File(fp=BytesIO(imagebytes), filename=filename),
-            view=view,
+        imagebytes, image_format = await client.render.submit(
+            caption_job, background, text
         )
+        filename = with_format_suffix(filename, image_format)
+        view = EditView(background, filename, imagebytes)
+        with phase("upload"):
+            msg = await ctx.followup.send(
+                file=discord.File(fp=BytesIO(imagebytes), filename=filename),
+                view=view,
+            )
         view.message = msg
 
     except ValueError as v:
+        set_outcome("invalid")
         print(v)
         await ctx.followup.send(str(v), ephemeral=True)
         return
 
     except Exception as e:
+        set_outcome("error")
         print(e)
         print(traceback.format_exc())
         await ctx.followup.send("Error creating meme", ephemeral=True)
@@ -320,11 +478,10 @@ async def creatememe(
 async def memetemplates(ctx: discord.Interaction, search: str = ""):
     await ctx.response.defer()
     try:
-        baseurl = "https://api.memegen.link/templates"
-        if search != "":
-            response = (httpClient.get(baseurl, params={"filter": search})).json()
-        else:
-            response = (httpClient.get(baseurl)).json()
+        # only wait for the api if the catalog could not be loaded yet
+        if len(template_catalog.templates) == 0:
+            await template_catalog.refresh()
+        response = template_catalog.search(search)
 
         if len(response) == 0:
             await ctx.followup.send("No templates found", ephemeral=True)
@@ -332,14 +489,14 @@ async def memetemplates(ctx: discord.Interaction, search: str = ""):
 
         def containerfunc(response, count: int) -> discord.ui.Container:
             description = "Use this template by providing the id in /creatememetemplate"
-            title = f"# {response[count]['name']}"
+            title = f"# {response[count].name}"
             title_display = discord.ui.TextDisplay(title)
             desc_display = discord.ui.TextDisplay(description)
 
-            field_display = discord.ui.TextDisplay(f" id \n {response[count]['id']}")
+            field_display = discord.ui.TextDisplay(f" id \n {response[count].id}")
 
             media = discord.ui.MediaGallery()
-            media.add_item(media=response[count]["blank"])
+            media.add_item(media=response[count].blank)
 
             cont = discord.ui.Container(
                 title_display, desc_display, field_display, media
@@ -351,6 +508,7 @@ async def memetemplates(ctx: discord.Interaction, search: str = ""):
         view.message = msg
 
     except Exception as e:
+        set_outcome("error")
         print(e)
         print(traceback.format_exc())
         await ctx.followup.send("Error searching meme templates", ephemeral=True)
@@ -362,21 +520,49 @@ async def memetemplates(ctx: discord.Interaction, search: str = ""):
 @app_commands.describe(id="id of template", text="top and bottom text seperated by ,")
 @log_arguments
 @timer_function
+@memoize()
 async def creatememetemplate(ctx: discord.Interaction, id: str, text: str):
     await ctx.response.defer()
     try:
+        if template_catalog.templates and template_catalog.get(id) is None:
+            suggestions = ", ".join(t.id for t in template_catalog.search(id, 3))
+            message = f"Unknown template id {id.strip()}"
+            if suggestions:
+                message += f", did you mean {suggestions}?"
+            await ctx.followup.send(message, ephemeral=True)
+            return
+
         baseurl = f"https://api.memegen.link/templates/{id.strip()}"
         payload = {"text": text.split(",")}
 
-        response = (httpClient.post(baseurl, data=payload)).json()
-        await ctx.followup.send(response["url"])
+        async def create() -> bytes:
+            response = (await http_client.post(baseurl, data=payload)).json()
+            return response["url"].encode()
+
+        url = await render_cache.memoized((id.strip(), text), create)
+        await ctx.followup.send(url.decode())
 
     except Exception as e:
+        set_outcome("error")
         print(e)
         print(traceback.format_exc())
         await ctx.followup.send("Error creating meme", ephemeral=True)
 
 
+@creatememetemplate.autocomplete("id")
+async def template_id_autocomplete(
+    ctx: discord.Interaction, current: str
+) -> list[app_commands.Choice[str]]:
+    choices = template_completions.get(ctx.user.id, current)
+    if choices is None:
+        choices = [
+            app_commands.Choice(name=f"{t.name} ({t.id})"[:100], value=t.id)
+            for t in template_catalog.complete(current)
+        ]
+        template_completions.put(ctx.user.id, current, choices)
+    return choices
+
+
 @client.tree.command(
     name="knowyourmeme", description="Searches know your meme for submission"
 )
@@ -386,25 +572,7 @@ async def creatememetemplate(ctx: discord.Interaction, id: str, text: str):
 async def kym(ctx: discord.Interaction, search: str):
     await ctx.response.defer()
     try:
-        url = f"https://knowyourmeme.com/search?q={search.replace(' ', '+')}"
-        header = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/106.0.0.0 Safari/537.36"
-        }
-
-        resp = httpClient.get(url, headers=header)
-        soup = BeautifulSoup(resp.content, "html.parser")
-        all_links: list[str] = []
-        for link in soup.find_all("a"):
-            href_val = link.get("href", "")
-            if (
-                "/memes/" in href_val
-                and len(href_val.split("/")) == 3
-                and "=" not in href_val
-                and link.get("class", "") == ["item"]
-            ):
-                all_links.append(f"https://knowyourmeme.com{href_val}")
-
-        all_links = list(dict.fromkeys(all_links))
+        all_links = await kym_search.search(search)
 
         if len(all_links) == 0:
             await ctx.followup.send("No results found", ephemeral=True)
@@ -421,6 +589,7 @@ async def kym(ctx: discord.Interaction, search: str):
                 await msg.edit_original_response(view=None)  # type: ignore
 
     except Exception as e:
+        set_outcome("error")
         print(e)
         print(traceback.format_exc())
         await ctx.followup.send("Error searching kym", ephemeral=True)
@@ -430,71 +599,20 @@ async def kym(ctx: discord.Interaction, search: str):
 @app_commands.describe(text="name of user")
 @log_arguments
 @timer_function
+@memoize()
 async def bday(ctx: discord.Interaction, text: str):
     await ctx.response.defer()
     try:
-        image_path = "images/Laser.jpg"
-        font_path = "uni.ttf"
-        angle = 35
-        img = Image.open(image_path).convert("RGBA")
-        font_size = 35
-
-        # Load font
-        try:
-            if font_path:
-                font = ImageFont.truetype(font_path, font_size)
-            else:
-                font = ImageFont.load_default()
-        except OSError:
-            print(f"Warning: Could not load font from {font_path}. Using default font.")
-            font = ImageFont.load_default()
-
-        text_width = 20 * len(text)
-        text_height = 30
-        # Get font size
-        for font_size in range(35, 15, -1):
-            font = ImageFont.truetype(font_path, font_size)
-            # get bounding box
-            bbox = font.getbbox(text)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-
-            if text_width <= 145:
-                break
-
-        # create a blank image for text
-        x_size = text_width + 5
-        y_size = text_height + 20
-        txt_img = Image.new("RGBA", (x_size, y_size))
-        d = ImageDraw.Draw(txt_img)
-
-        # Draw text on the blank image
-        # Position the text at the center of the temporary image
-        # text_x = (x_size - text_width) / 2
-        # text_y = (y_size - text_height) / 2
-        d.text((0, 0), text, font=font, fill="black")
-
-        # Rotate the text image
-        rotated_txt_img = txt_img.rotate(
-            angle, expand=1, resample=Image.Resampling.BILINEAR
-        )
-
-        # bottom left coord
-        bl_coord = (-8, img.size[1] - 35)
-        # top left coord
-        tl_coord = (bl_coord[0], bl_coord[1] - rotated_txt_img.size[1])
-
-        img.paste(rotated_txt_img, tl_coord, rotated_txt_img)
-        with BytesIO() as image_binary:
-            img.save(image_binary, "PNG")
-            image_binary.seek(0)
+        imagebytes = await client.render.submit(birthday_job, text)
+        with phase("upload"):
             await ctx.followup.send(
                 file=discord.File(
-                    fp=image_binary,
+                    fp=BytesIO(imagebytes),
                     filename=f"{clean_str(text)}.png",
                 )
             )
     except Exception as e:
+        set_outcome("error")
         print(e)
         print(traceback.format_exc())
         await ctx.followup.send("Error creating birthday image", ephemeral=True)
@@ -519,10 +637,6 @@ async def grid(
 ):
     await ctx.response.defer()
     try:
-        img_width = 300
-        img_height = 300
-        FONT_SIZE = 30
-
         imagelst = [
             image1,
             image2,
@@ -536,46 +650,57 @@ async def grid(
         ]
         imagelst_filtered = [x for x in imagelst if x is not None]
 
-        rows = round(len(imagelst_filtered) ** (1 / 2))
-        if rows**2 < len(imagelst_filtered):
-            cols = rows + 1
-        else:
-            cols = rows
-
-        final_width = img_width * cols
-        final_height = img_height * rows + 50
-
-        newimg = Image.new("RGB", (final_width, final_height), color="white")  # type: ignore
-        draw = ImageDraw.Draw(newimg)
-        font = ImageFont.truetype("uni.ttf", FONT_SIZE, encoding="unic")
+        async def make_tile(number: int, img: discord.Attachment) -> bytes:
+            # only the download is limited here, the render job has its own
+            # timeout once a worker runs it
+            imgbytes = await asyncio.wait_for(
+                download(img.url, 10 * MB, f"attachment:{img.id}"), GRID_TILE_TIMEOUT
+            )
+            return await client.render.submit(grid_tile_job, imgbytes, number)
 
-        draw.text((5, 5), title, font=font, fill=(0, 0, 0))
+        # tiles are downloaded and decoded concurrently, a tile that fails or
+        # takes too long is left empty instead of failing the whole grid
+        results = await asyncio.gather(
+            *(make_tile(ii + 1, img) for ii, img in enumerate(imagelst_filtered)),
+            return_exceptions=True,
+        )
+        tiles: list[bytes | None] = []
+        skipped: list[str] = []
+        for ii, result in enumerate(results):
+            if isinstance(result, bytes):
+                tiles.append(result)
+            else:
+                print(f"Grid tile {ii + 1} failed: {result!r}")
+                tiles.append(None)
+                skipped.append(str(ii + 1))
+        if len(skipped) == len(tiles):
+            await ctx.followup.send("Could not load any image", ephemeral=True)
+            return
 
-        for ii, img in enumerate(imagelst_filtered):
-            grid_img = Image.open(BytesIO(httpx.get(img.url).content))
-            grid_img = grid_img.resize((img_width, img_height))
-            num = str(ii + 1)
-            corner = (ii % cols) * img_width, (ii // cols) * img_height + 50
-            grid_img_draw = ImageDraw.Draw(grid_img)
-            grid_img_draw.text((5, 5), num, font=font, embedded_color=True)
-            newimg.paste(grid_img, corner)
+        imagebytes = await client.render.submit(grid_job, title, tiles)
 
         filename = str(Path(clean_str(title)).with_suffix(".png"))
-        with BytesIO() as image_binary:
-            newimg.save(image_binary, "PNG")
-            image_binary.seek(0)
+        content = f"Could not load image {', '.join(skipped)}" if skipped else None
+        with phase("upload"):
             await ctx.followup.send(
+                content=content,
                 file=discord.File(
-                    fp=image_binary,
+                    fp=BytesIO(imagebytes),
                     filename=filename,
-                )
+                ),
             )
 
     except Exception as e:
+        set_outcome("error")
         print(e)
         print(traceback.format_exc())
         await ctx.followup.send("Error making grid image", ephemeral=True)
 
 
-if __name__ == "__main__":
+def main():
     client.run(TOKEN)
+
+
+if __name__ == "__main__":
+    # the render workers would run this whole module again
+    raise SystemExit("Start the bot with main.py")
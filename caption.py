@@ -0,0 +1,147 @@
+from collections.abc import Iterator
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFont, ImageSequence
+
+from assets import FONT_PATH, get_font
+from gifs import GifWriter
+
+# fraction of the image height each caption may take up
+MAX_CAPTION_HEIGHT = 0.3
+MIN_FONT_SIZE = 10
+MARGIN = 0.03
+
+SAVE_FORMATS = ("JPEG", "PNG", "GIF", "WEBP")
+
+
+def split_caption(text: str) -> tuple[str, str]:
+    """Splits comma separated text into top and bottom text, an empty first
+    part means the meme only has bottom text.
+    Args:
+        text (str): Caption lines separated by ,
+    Returns:
+        tuple[str, str]: Top and bottom text."""
+    lines = [x.strip() for x in text.split(",")]
+    top = lines[0]
+    bottom = "\n".join(line for line in lines[1:] if line)
+    return top, bottom
+
+
+def wrap_text(text: str, font: ImageFont.FreeTypeFont, max_width: float) -> list[str]:
+    """Greedily wraps text on spaces so every line fits in max_width."""
+    lines = []
+    for paragraph in text.split("\n"):
+        line = ""
+        for word in paragraph.split():
+            candidate = f"{line} {word}" if line else word
+            if line and font.getlength(candidate) > max_width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+def fit_text(
+    text: str, max_width: float, max_height: float, font_path: str = FONT_PATH
+) -> tuple[ImageFont.FreeTypeFont, list[str]]:
+    """Finds the largest font size at which the wrapped text fits in a box.
+    Args:
+        text (str): Text to fit.
+        max_width (float): Width of the box.
+        max_height (float): Height of the box.
+        font_path (str): Path of the font file.
+    Returns:
+        tuple[ImageFont.FreeTypeFont, list[str]]: The font and wrapped lines."""
+    size = max(MIN_FONT_SIZE, int(max_height))
+    while True:
+        font = get_font(size, font_path)
+        lines = wrap_text(text, font, max_width)
+        if size <= MIN_FONT_SIZE:
+            return font, lines
+        line_height = size * 1.15
+        widest = max(font.getlength(line) for line in lines)
+        if widest <= max_width and line_height * len(lines) <= max_height:
+            return font, lines
+        # shrink faster while the text is far too big
+        size = max(MIN_FONT_SIZE, min(size - 1, int(size * 0.9)))
+
+
+def caption_layer(
+    size: tuple[int, int], top: str, bottom: str, font_path: str = FONT_PATH
+) -> Image.Image:
+    """Draws white text with a black outline at the top and bottom of a
+    transparent image that can be composited over every frame."""
+    width, height = size
+    layer = Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(layer)
+    margin = max(2, int(MARGIN * min(width, height)))
+    max_width = width - 2 * margin
+    max_height = height * MAX_CAPTION_HEIGHT
+
+    for text, anchor in ((top, "top"), (bottom, "bottom")):
+        if not text:
+            continue
+        font, lines = fit_text(text, max_width, max_height, font_path)
+        stroke = max(1, font.size // 15)
+        line_height = font.size * 1.15
+        if anchor == "top":
+            y = margin
+        else:
+            y = height - margin - line_height * len(lines)
+        for line in lines:
+            draw.text(
+                (width / 2, y),
+                line,
+                font=font,
+                fill="white",
+                stroke_width=stroke,
+                stroke_fill="black",
+                anchor="ma",
+            )
+            y += line_height
+    return layer
+
+
+def _captioned_frames(img: Image.Image, layer: Image.Image) -> Iterator[Image.Image]:
+    """Composites the caption over one frame at a time."""
+    for frame in ImageSequence.Iterator(img):
+        duration = frame.info.get("duration", 100)
+        captioned = Image.alpha_composite(frame.convert("RGBA"), layer)
+        captioned.info["duration"] = duration
+        yield captioned
+
+
+def caption_image(
+    imagebytes: bytes, text: str, font_path: str = FONT_PATH
+) -> tuple[bytes, str]:
+    """Captions an image or gif with top and bottom text.
+    Args:
+        imagebytes (bytes): The encoded background image.
+        text (str): Top and bottom text separated by ,
+        font_path (str): Path of the font file.
+    Returns:
+        tuple[bytes, str]: The captioned image and the format it was saved
+        in. Animations are saved as gif, still images in the format of the
+        background when possible and as png otherwise."""
+    top, bottom = split_caption(text)
+    img = Image.open(BytesIO(imagebytes))
+    layer = caption_layer(img.size, top, bottom, font_path)
+    image_format = img.format if img.format in SAVE_FORMATS else "PNG"
+
+    with BytesIO() as image_binary:
+        if getattr(img, "n_frames", 1) > 1:
+            image_format = "GIF"
+            alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+            # frames are decoded, captioned and encoded one at a time
+            writer = GifWriter(image_binary, img.size, img.info.get("loop", 0), alpha)
+            for frame in _captioned_frames(img, layer):
+                writer.add(frame, frame.info["duration"])
+            writer.close()
+        else:
+            captioned = Image.alpha_composite(img.convert("RGBA"), layer)
+            if image_format == "JPEG":
+                captioned = captioned.convert("RGB")
+            captioned.save(image_binary, image_format)
+        return image_binary.getvalue(), image_format
@@ -0,0 +1,99 @@
+from collections.abc import Callable
+from io import BytesIO
+from typing import TYPE_CHECKING
+
+# matplotlib is only imported by the render workers when they draw the
+# first chart, the bot process only parses the input
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
+    from matplotlib.figure import Figure
+
+MAX_VALUES = 50
+
+# figure and axes of each chart kind, built once per render worker and
+# cleared between charts instead of going through pyplot's global state
+_templates: dict[str, tuple["Figure", "Axes"]] = {}
+
+
+def parse_chart(labels: str, values: str) -> tuple[list[str], list[float]]:
+    """Splits comma separated labels and values.
+    Args:
+        labels (str): Labels separated by ,
+        values (str): Numbers separated by ,
+    Returns:
+        tuple[list[str], list[float]]: The labels and parsed values.
+    Raises:
+        ValueError: With a message for the user if the input is invalid."""
+    labelslst = [label.strip() for label in labels.split(",")]
+    try:
+        valueslst = [float(value) for value in values.split(",")]
+    except ValueError:
+        raise ValueError("values must be numbers seperated by ,") from None
+    if len(labelslst) != len(valueslst):
+        raise ValueError(
+            f"got {len(labelslst)} labels but {len(valueslst)} values, "
+            "they must have the same length"
+        )
+    if len(valueslst) > MAX_VALUES:
+        raise ValueError(f"charts can have at most {MAX_VALUES} values")
+    return labelslst, valueslst
+
+
+def _get_template(kind: str) -> tuple["Figure", "Axes"]:
+    if kind not in _templates:
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        fig = Figure(figsize=(6.4, 4.8), dpi=100)
+        FigureCanvasAgg(fig)
+        _templates[kind] = (fig, fig.add_subplot())
+    fig, ax = _templates[kind]
+    ax.clear()
+    return fig, ax
+
+
+def _draw_pie(ax: "Axes", labels: list[str], values: list[float]) -> None:
+    if any(value < 0 for value in values) or sum(values) <= 0:
+        raise ValueError("pie chart values must be positive")
+    ax.pie(values)
+    ax.legend(labels=labels, loc="best", bbox_to_anchor=(1, 0.85))
+
+
+def _draw_bar(ax: "Axes", labels: list[str], values: list[float]) -> None:
+    positions = range(len(values))
+    ax.bar(positions, values)
+    ax.set_xticks(positions, labels, rotation=45 if len(values) > 6 else 0)
+
+
+def _draw_line(ax: "Axes", labels: list[str], values: list[float]) -> None:
+    positions = range(len(values))
+    ax.plot(positions, values, marker="o")
+    ax.set_xticks(positions, labels, rotation=45 if len(values) > 6 else 0)
+    ax.grid(True, alpha=0.3)
+
+
+DRAW_FUNCTIONS: dict[str, Callable[["Axes", list[str], list[float]], None]] = {
+    "pie": _draw_pie,
+    "bar": _draw_bar,
+    "line": _draw_line,
+}
+
+
+def render_chart(
+    kind: str, labels: list[str], values: list[float], title: str
+) -> bytes:
+    """Draws a chart as a png.
+    Args:
+        kind (str): One of pie, bar or line.
+        labels (list[str]): Label of each value.
+        values (list[float]): Values to plot.
+        title (str): Title of the chart.
+    Returns:
+        bytes: The encoded png."""
+    fig, ax = _get_template(kind)
+    DRAW_FUNCTIONS[kind](ax, labels, values)
+    ax.set_title(title)
+
+    with BytesIO() as image_binary:
+        fig.savefig(image_binary, format="png", bbox_inches="tight")
+        return image_binary.getvalue()
@@ -1,18 +1,16 @@
-import tempfile
 import traceback
 from io import BytesIO
 from pathlib import Path
 
 import discord
-from apnggif import apnggif
 from discord import app_commands
 from discord.ext import commands
-from PIL import Image, ImageSequence
 
-from decorators import log_arguments, timer_function
+from decorators import log_arguments, memoize, timer_function
 from image_handler import create_image_class
 from layoutviews import RerollView
-from utils import seekrandomframe
+from metrics import phase, set_outcome
+from render import apng2gif_job, random_frame_job, reversegif_job
 
 
 class GifCommands(commands.Cog):
@@ -35,23 +33,20 @@ class GifCommands(commands.Cog):
             filename = str(Path(img.get_filename()).with_suffix(".gif"))
             imagebytes = await img.get_image_bytes()
 
-            with tempfile.NamedTemporaryFile(
-                suffix=".png", delete_on_close=False
-            ) as fp, tempfile.NamedTemporaryFile(suffix=".gif") as fp2:
-                fp.write(imagebytes)
-                fp.close()
-                # convert to gif
-                apnggif(png=fp.name, gif=fp2.name)
-                filepath = str(Path(fp2.name).with_suffix(".gif"))
+            # convert to gif
+            gifbytes = await self.bot.render.submit(apng2gif_job, imagebytes)
+            with phase("upload"):
                 await ctx.followup.send(
-                    file=discord.File(fp=filepath, filename=filename)
+                    file=discord.File(fp=BytesIO(gifbytes), filename=filename)
                 )
 
         except ValueError as v:
+            set_outcome("invalid")
             print(v)
             await ctx.followup.send(str(v), ephemeral=True)
             return
         except Exception as e:
+            set_outcome("error")
             print(e)
             print(traceback.format_exc())
             await ctx.followup.send("Error converting to gif", ephemeral=True)
@@ -72,21 +67,26 @@ class GifCommands(commands.Cog):
             imgbytes = await img.get_image_bytes()
             filename = str(Path(img.get_filename()).with_suffix(".png"))
 
-            image_binary = seekrandomframe(imgbytes)
+            image_binary = BytesIO(
+                await self.bot.render.submit(random_frame_job, imgbytes)
+            )
             # send final image
             view = RerollView(imgbytes, filename, image_binary)
 
-            msg = await ctx.followup.send(
-                file=discord.File(fp=image_binary, filename=filename), view=view
-            )
+            with phase("upload"):
+                msg = await ctx.followup.send(
+                    file=discord.File(fp=image_binary, filename=filename), view=view
+                )
             view.message = msg
 
         except ValueError as v:
+            set_outcome("invalid")
             print(v)
             await ctx.followup.send(str(v), ephemeral=True)
             return
 
         except Exception as e:
+            set_outcome("error")
             print(e)
             print(traceback.format_exc())
             await ctx.followup.send("Error generating random frame", ephemeral=True)
@@ -95,6 +95,7 @@ class GifCommands(commands.Cog):
     @app_commands.describe(file="gif file", link="direct url link to gif")
     @log_arguments
     @timer_function
+    @memoize()
     async def reversegif(
         self,
         ctx: discord.Interaction,
@@ -107,38 +108,22 @@ class GifCommands(commands.Cog):
             imgbytes = await img.get_image_bytes()
             filename = img.get_filename()
 
-            # read image from url
-            gif = Image.open(BytesIO(imgbytes))
-            frames: list = []
-
-            for frame in ImageSequence.Iterator(gif):
-                frames.append(frame.copy())
-
-            # Reverse the frames
-            frames.reverse()
-            frame_one = frames[0]
-
-            with BytesIO() as gif_binary:
-                frame_one.save(
-                    gif_binary,
-                    format="GIF",
-                    append_images=frames,
-                    save_all=True,
-                    loop=0,
-                    disposal=2,
-                )
-                gif_binary.seek(0)
+            gifbytes = await self.bot.render.submit(reversegif_job, imgbytes)
+            with phase("upload"):
                 await ctx.followup.send(
                     file=discord.File(
-                        fp=gif_binary, filename=str(Path(filename).with_suffix(".gif"))
+                        fp=BytesIO(gifbytes),
+                        filename=str(Path(filename).with_suffix(".gif")),
                     )
                 )
         except ValueError as v:
+            set_outcome("invalid")
             print(v)
             await ctx.followup.send(str(v), ephemeral=True)
             return
 
         except Exception as e:
+            set_outcome("error")
             print(e)
             print(traceback.format_exc())
             await ctx.followup.send("Error reversing gif", ephemeral=True)
@@ -0,0 +1,96 @@
+import asyncio
+import hashlib
+import json
+import traceback
+from pathlib import Path
+
+import discord
+import msgspec
+from discord import app_commands
+
+from utils import atomic_write_bytes
+
+
+def tree_fingerprint(tree: app_commands.CommandTree, guild: discord.Object) -> str:
+    """Hashes the payload the tree would sync to a guild.
+    Args:
+        tree (app_commands.CommandTree): The command tree.
+        guild (discord.Object): The guild the commands are synced to.
+    Returns:
+        str: Hex digest that changes whenever a command signature changes."""
+    payload = [command.to_dict(tree) for command in tree.get_commands(guild=guild)]
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class CommandSync:
+    """Syncs the command tree to guilds, skipping guilds whose commands did
+    not change since the last sync.
+
+    Fingerprints of the synced commands are stored per application and guild
+    in path, so dev and prod bots sharing a checkout don't mix them up."""
+
+    def __init__(
+        self, path: str = "cache/command_sync.json", max_concurrent: int = 4
+    ) -> None:
+        self.path = Path(path)
+        self.max_concurrent = max_concurrent
+
+    def _load(self) -> dict[str, str]:
+        try:
+            return msgspec.json.decode(self.path.read_bytes(), type=dict[str, str])
+        except (FileNotFoundError, msgspec.DecodeError):
+            return {}
+
+    def _save(self, fingerprints: dict[str, str]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_bytes(self.path, msgspec.json.encode(fingerprints))
+
+    async def sync(
+        self,
+        tree: app_commands.CommandTree,
+        guilds: list[discord.Object],
+        force: bool = False,
+    ) -> list[discord.Object]:
+        """Copies the global commands to every guild and syncs the guilds
+        that changed, a few at a time. Discord.py waits out the rate limits
+        of each request.
+        Args:
+            tree (app_commands.CommandTree): The command tree.
+            guilds (list[discord.Object]): Guilds to sync to.
+            force (bool): Sync every guild even if nothing changed.
+        Returns:
+            list[discord.Object]: The guilds that were synced."""
+        fingerprints = self._load()
+        pending: list[tuple[discord.Object, str, str]] = []
+        for guild in guilds:
+            tree.copy_global_to(guild=guild)
+            key = f"{tree.client.application_id}:{guild.id}"
+            fingerprint = tree_fingerprint(tree, guild)
+            if force or fingerprints.get(key) != fingerprint:
+                pending.append((guild, key, fingerprint))
+
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        async def sync_guild(guild: discord.Object) -> None:
+            async with semaphore:
+                await tree.sync(guild=guild)
+
+        results = await asyncio.gather(
+            *(sync_guild(guild) for guild, _, _ in pending), return_exceptions=True
+        )
+        synced = []
+        for (guild, key, fingerprint), result in zip(pending, results):
+            if isinstance(result, BaseException):
+                # the fingerprint is not stored, so the next start retries
+                print(f"Could not sync commands to guild {guild.id}")
+                print("".join(traceback.format_exception(result)))
+                continue
+            fingerprints[key] = fingerprint
+            synced.append(guild)
+        if synced:
+            self._save(fingerprints)
+        return synced
+
+
+command_sync = CommandSync()
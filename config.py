@@ -1,14 +1,44 @@
 import argparse
 import ast
 import configparser
+import os
 from typing import List, NamedTuple
 
 import discord
 
+# render workers started when the config doesn't set a number, each one holds
+# its own copy of the templates and fonts
+MAX_DEFAULT_WORKERS = 4
+
+
+class RenderConfiguration(NamedTuple):
+    workers: int
+    max_tasks_per_child: int
+    timeout: float
+
+
+class MetricsConfiguration(NamedTuple):
+    host: str
+    port: int
+
 
 class Configuration(NamedTuple):
     token: str
     guilds: list[discord.Object]
+    render: RenderConfiguration
+    metrics: MetricsConfiguration
+
+
+def default_workers() -> int:
+    """Returns the number of CPUs this process may run on, which respects
+    taskset and cpuset limits unlike os.cpu_count, capped at
+    MAX_DEFAULT_WORKERS."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        # sched_getaffinity is not available on macos and windows
+        cpus = os.cpu_count() or 1
+    return max(1, min(cpus, MAX_DEFAULT_WORKERS))
 
 
 def read_configs(prod: bool) -> Configuration:
@@ -24,11 +54,27 @@ def read_configs(prod: bool) -> Configuration:
     TOKEN = conf["DISCORD"]["token"]
     guild_list: list[int] = ast.literal_eval(conf["DISCORD"]["guilds"])
     MY_GUILDS = [discord.Object(id=guild) for guild in guild_list]
-    return Configuration(token=TOKEN, guilds=MY_GUILDS)
+    render = RenderConfiguration(
+        workers=conf.getint("RENDER", "workers", fallback=default_workers()),
+        max_tasks_per_child=conf.getint("RENDER", "max_tasks_per_child", fallback=50),
+        timeout=conf.getfloat("RENDER", "timeout", fallback=60.0),
+    )
+    # port 0 turns the /metrics endpoint off
+    metrics = MetricsConfiguration(
+        host=conf.get("METRICS", "host", fallback="127.0.0.1"),
+        port=conf.getint("METRICS", "port", fallback=9091),
+    )
+    return Configuration(token=TOKEN, guilds=MY_GUILDS, render=render, metrics=metrics)
 
 
 def parse_cli_args():
     parser = argparse.ArgumentParser(prog="MemeBot", description="Discord Bot")
     parser.add_argument("--prod", action="store_true", default=False)
+    parser.add_argument(
+        "--force-sync",
+        action="store_true",
+        default=False,
+        help="sync commands to every guild even if they did not change",
+    )
 
     return parser.parse_args()
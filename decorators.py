@@ -1,15 +1,73 @@
 import time
 from functools import wraps
+from pathlib import Path
 from collections.abc import Callable
 
+import discord
+
+from metrics import track_command
+from rendercache import current_command
+from tracing import current_profile, profile_to, span
+
+
+class CommandProfiler:
+    """Runs the next invocations of a command under cProfile, switched on by
+    the bot owner with /profile. Stats of the bot process and of every render
+    job the command submits are dumped to directory as .pstats files.
+
+    The profiler of the bot process also sees the other tasks of the event
+    loop that run while the command awaits."""
+
+    def __init__(self, directory: str = "profiles") -> None:
+        self.directory = Path(directory)
+        # names of the app commands that can be profiled, filled in once the
+        # command tree is complete
+        self.commands: set[str] = set()
+        self._remaining: dict[str, int] = {}
+
+    def enable(self, command: str, invocations: int) -> None:
+        self._remaining[command] = invocations
+
+    def take(self, command: str) -> str | None:
+        """Returns the path prefix of the stats files if this invocation of
+        command is profiled."""
+        remaining = self._remaining.get(command, 0)
+        if remaining <= 0:
+            return None
+        self._remaining[command] = remaining - 1
+        return str(self.directory / f"{command}-{time.time_ns() // 1_000_000}")
+
+
+command_profiler = CommandProfiler()
+
+
+def command_name(func: Callable, args: tuple) -> str:
+    """Returns the name a command is invoked with in discord, which can differ
+    from the name of its function, like knowyourmeme for kym."""
+    for arg in args:
+        if isinstance(arg, discord.Interaction) and arg.command is not None:
+            return arg.command.qualified_name
+    return func.__name__
+
 
 def timer_function(func: Callable):
     @wraps(func)
     async def wrapper(*args, **kwargs):
         start_time = time.perf_counter()
-        result = await func(*args, **kwargs)
+        name = command_name(func, args)
+        profile = command_profiler.take(name)
+        token = current_profile.set(profile)
+        try:
+            with (
+                track_command(name),
+                span(name),
+                profile_to(f"{profile}-bot.pstats" if profile else None),
+            ):
+                result = await func(*args, **kwargs)
+        finally:
+            current_profile.reset(token)
         end_time = time.perf_counter()
-        print(f"Function {func.__name__} took {end_time - start_time} seconds to run")
+        print(f"Function {name} took {end_time - start_time} seconds to run")
         return result
 
     return wrapper
@@ -22,3 +80,23 @@ def log_arguments(func: Callable):
         return await func(*args, **kwargs)
 
     return wrapper
+
+
+def memoize(ttl: float = 3600):
+    """Caches the rendered output of a deterministic command for ttl seconds.
+
+    Render jobs submitted while the command runs are looked up in the render
+    cache by command name, job arguments and the hash of input files."""
+
+    def decorator(func: Callable):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = current_command.set((func.__name__, ttl))
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                current_command.reset(token)
+
+        return wrapper
+
+    return decorator
@@ -1,52 +1,51 @@
 import colorsys
+import fcntl
 import io
+import os
+from collections.abc import Iterator
+from contextlib import contextmanager
 
 import numpy as np
 from PIL import Image
 
+from assets import decode_scaled, get_image, get_tile
+from utils import atomic_open
 
-def dumpy(imagebytes: bytes, ty: int) -> list[Image.Image]:
-    """Generates an amongus image from input image bytes
-    Args:
-        imagebytes (bytes): The bytes of the input image.
-        ty (int): The desired height of the output image.
-    Returns:
-        list[Image.Image]: A list of PIL Image frames representing the amongus image."""
-    background: str = "dumpy/black.png"
+# colours of the crewmate body and its shadow in the tile images
+BODY_COLOR = (197, 17, 17)
+SHADE_COLOR = (122, 8, 56)
+TILE_COUNT = 6
 
-    backgroundimg = Image.open(background).convert("RGB")
+# precomputed shader output for every input colour, built on first use
+LUT_PATH = "dumpy/shader_lut.npy"
+LUT_BITS = 8
+_shader_lut: np.ndarray | None = None
 
-    inputimg = Image.open(io.BytesIO(imagebytes)).convert("RGB")
+
+def _prepare(
+    imagebytes: bytes, ty: int
+) -> tuple[Image.Image, Image.Image, list[Image.Image], tuple[int, int, int, int, int]]:
+    """Loads the assets and works out the output layout shared by both renderers.
+    Returns:
+        The background, the resized input image, the shared crewmate tiles and
+        the (mox, moy, pad, ix, iy) layout of the output frames."""
+    backgroundimg = get_image("dumpy/black.png", "RGB")
+
+    inputimg = Image.open(io.BytesIO(imagebytes))
 
     # Calculates size from height
     txd = inputimg.width / inputimg.height
     tx = int(round(ty * txd * 0.862))
 
-    # Prepares source image
-    inputimage = inputimg.resize((tx, ty))
-
-    # sets up loop vars
-    bufferedImageArraySize = 6
-    count1Check = 6
-    count2Reset = 5
-    sourceX = 74
-    sourceY = 63
+    # Prepares source image, only decoding as much detail as the output needs
+    inputimage = decode_scaled(inputimg, (tx, ty))
 
     # Sets up BG
-    pad = 10
-    ix = (tx * sourceX) + (pad * 2)
-    iy = (ty * sourceY) + (pad * 2)
-
-    # Actually makes the frames
-    frames: list[Image.Image] = []
-
-    # these constants are now variables.
     mox = 74
     moy = 63
-    moguses: list[Image.Image] = []
-    for it in range(0, bufferedImageArraySize):
-        temp = f"dumpy/{it}.png"
-        moguses.append(Image.open(temp).convert("RGB"))
+    pad = 10
+    ix = (tx * mox) + (pad * 2)
+    iy = (ty * moy) + (pad * 2)
 
     if ix > 1000 or iy > 1000:
         if ix > iy:
@@ -56,64 +55,290 @@ def dumpy(imagebytes: bytes, ty: int) -> list[Image.Image]:
 
         mox = int(round(mox * fac))
         moy = int(round(moy * fac))
-        for itt in range(0, bufferedImageArraySize):
-            moguses[itt] = moguses[itt].resize((mox, moy))
 
         pad = int(pad * fac)
         ix = (mox * tx) + (pad * 2)
         iy = (moy * ty) + (pad * 2)
 
-    for index in range(0, bufferedImageArraySize):
-        indexx = index
-        F_bg = backgroundimg
-        F_ty = ty
-        F_tx = tx
-        F_count1Check = count1Check
-        F_count2Reset = count2Reset
-        ixF = ix
-        iyF = iy
-        moxF = mox
-        moyF = moy
-        padF = pad
+    moguses = [
+        get_tile(f"dumpy/{it}.png", "RGB", (mox, moy)) for it in range(TILE_COUNT)
+    ]
+
+    return backgroundimg, inputimage, moguses, (mox, moy, pad, ix, iy)
+
+
+def dumpy(imagebytes: bytes, ty: int, exact: bool = False) -> list[Image.Image]:
+    """Generates an amongus image from input image bytes
+    Args:
+        imagebytes (bytes): The bytes of the input image.
+        ty (int): The desired height of the output image.
+        exact (bool): Compute the crewmate colours with colorsys instead of
+            the shader lookup table.
+    Returns:
+        list[Image.Image]: A list of PIL Image frames representing the amongus image."""
+    _, inputimage, moguses, layout = _prepare(imagebytes, ty)
+    mox, moy, pad, ix, iy = layout
+    tx = inputimage.width
+
+    # recolour every input pixel once
+    colors = _pack(recolor(np.asarray(inputimage).reshape(-1, 3), exact=exact))
+    body = colors[:, 0].reshape(ty, tx, 1, 1)
+    shade = colors[:, 1].reshape(ty, tx, 1, 1)
+
+    tiles = _pack(np.stack([np.asarray(mogus) for mogus in moguses]))
+    body_mask = tiles == _pack(np.array(BODY_COLOR, dtype=np.uint8))
+    shade_mask = tiles == _pack(np.array(SHADE_COLOR, dtype=np.uint8))
+    # shader() fills the body before the shadow, so a body filled with the
+    # shadow colour gets shaded as well
+    body_is_shade = body == _pack(np.array(SHADE_COLOR, dtype=np.uint8))
+
+    # crewmate animation step of every tile, shifted by one per row and frame
+    steps = np.arange(tx)[None, :] - np.arange(ty)[:, None]
+
+    background = np.asarray(get_image("dumpy/black.png", "RGB", (ix, iy)))
+    frames: list[Image.Image] = []
+    for index in range(TILE_COUNT):
+        tile_index = (steps + index) % TILE_COUNT
+        is_body = body_mask[tile_index]
+        is_shade = shade_mask[tile_index]
+        if body_is_shade.any():
+            is_shade |= is_body & body_is_shade
+        mosaic = tiles[tile_index]
+        np.copyto(mosaic, body, where=is_body)
+        np.copyto(mosaic, shade, where=is_shade)
+
+        frame = background.copy()
+        frame[pad : pad + ty * moy, pad : pad + tx * mox] = _unpack(
+            mosaic.transpose(0, 2, 1, 3).reshape(ty * moy, tx * mox)
+        )
+        frames.append(Image.fromarray(frame))
+    return frames
+
+
+def recolor(pixels: np.ndarray, exact: bool = False) -> np.ndarray:
+    """Maps RGB pixels to the crewmate body and shadow colours.
+    Args:
+        pixels (np.ndarray): uint8 array of shape (..., 3).
+        exact (bool): Use shade_colors for every unique colour instead of
+            the lookup table, used to verify the table.
+    Returns:
+        np.ndarray: uint8 array of shape (..., 2, 3) holding the body and
+        shadow colour of every pixel."""
+    if exact:
+        unique, inverse = np.unique(pixels.reshape(-1, 3), axis=0, return_inverse=True)
+        colors = np.array(
+            [shade_colors(tuple(int(c) for c in rgb)) for rgb in unique]  # type: ignore
+        ).astype(np.uint8)
+        return colors[inverse.reshape(-1)].reshape(pixels.shape[:-1] + (2, 3))
+
+    lut = load_shader_lut()
+    shift = 8 - (lut.shape[0].bit_length() - 1)
+    index = pixels >> shift
+    return lut[index[..., 0], index[..., 1], index[..., 2]]
+
+
+def load_shader_lut(path: str = LUT_PATH, bits: int = LUT_BITS) -> np.ndarray:
+    """Memory maps the shader lookup table, building it first if it is missing
+    or was built with a different resolution."""
+    global _shader_lut
+    if _shader_lut is not None and _shader_lut.shape[0] == 1 << bits:
+        return _shader_lut
 
-        frames.append(F_bg.resize((ixF, iyF)))
+    lut = _open_shader_lut(path, bits)
+    if lut is None:
+        # the bot and every render worker can get here at the same time, the
+        # first one builds the table and the others wait for it
+        with _file_lock(f"{path}.lock"):
+            lut = _open_shader_lut(path, bits)
+            if lut is None:
+                build_shader_lut(path, bits)
+                lut = np.load(path, mmap_mode="r")
 
-        count = indexx
-        count2 = indexx
+    _shader_lut = lut
+    return lut
+
+
+def _open_shader_lut(path: str, bits: int) -> np.ndarray | None:
+    if not os.path.exists(path):
+        return None
+    lut = np.load(path, mmap_mode="r")
+    if lut.shape != (1 << bits,) * 3 + (2, 3) or lut.dtype != np.uint8:
+        return None
+    return lut
+
+
+@contextmanager
+def _file_lock(path: str) -> Iterator[None]:
+    """Holds an exclusive lock on path, shared between processes."""
+    with open(path, "wb") as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+def build_shader_lut(path: str = LUT_PATH, bits: int = LUT_BITS) -> None:
+    """Computes the shader output for every colour and saves it as a .npy file.
+    Args:
+        path (str): Where to write the table.
+        bits (int): Bits per channel, 8 gives an exact table of every 24 bit
+            colour, fewer bits quantize the input to the centre of its bin."""
+    size = 1 << bits
+    shift = 8 - bits
+    levels = np.arange(size, dtype=np.uint16) << shift
+    if shift > 0:
+        levels |= 1 << (shift - 1)
+
+    lut = np.empty((size, size, size, 2, 3), dtype=np.uint8)
+    g, b = np.meshgrid(levels, levels, indexing="ij")
+    # one red level at a time keeps the float64 temporaries small
+    for r in range(size):
+        rgb = np.stack([np.full_like(g, levels[r]), g, b], axis=-1)
+        lut[r] = _shade_colors_array(rgb.astype(np.float64))
+
+    # a half written table is never loaded
+    with atomic_open(path) as fp:
+        np.save(fp, lut)
+
+
+def _rgb_to_hsv(r: np.ndarray, g: np.ndarray, b: np.ndarray):
+    """Vectorized colorsys.rgb_to_hsv, matching it bit for bit."""
+    maxc = np.maximum(np.maximum(r, g), b)
+    minc = np.minimum(np.minimum(r, g), b)
+    rangec = maxc - minc
+    grey = minc == maxc
+    with np.errstate(divide="ignore", invalid="ignore"):
+        s = np.where(grey, 0.0, rangec / maxc)
+        rc = (maxc - r) / rangec
+        gc = (maxc - g) / rangec
+        bc = (maxc - b) / rangec
+    h = np.where(r == maxc, bc - gc, np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    h = np.where(grey, 0.0, np.mod(h / 6.0, 1.0))
+    return h, s, maxc
+
+
+def _hsv_to_rgb(h: np.ndarray, s: np.ndarray, v: np.ndarray):
+    """Vectorized colorsys.hsv_to_rgb, matching it bit for bit."""
+    i = (h * 6.0).astype(np.int64)
+    f = (h * 6.0) - i
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    i = i % 6
+    choices = [
+        (v, t, p),
+        (q, v, p),
+        (p, v, t),
+        (p, q, v),
+        (t, p, v),
+        (v, p, q),
+    ]
+    grey = s == 0.0
+    return tuple(
+        np.where(
+            grey, v, np.select([i == k for k in range(6)], [c[ch] for c in choices])
+        )
+        for ch in range(3)
+    )
+
+
+def _shade_colors_array(rgb: np.ndarray) -> np.ndarray:
+    """Vectorized shade_colors over float64 pixels of shape (..., 3).
+    Returns the body and shadow colours as a uint8 array of shape (..., 2, 3)."""
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    h, s, v = _rgb_to_hsv(r, g, b)
+    blackLevel = 0.200
+    dim = v < blackLevel
+    floored = _hsv_to_rgb(h, s, np.full_like(v, blackLevel))
+    entry = [np.where(dim, fl, ch) for fl, ch in zip(floored, (r, g, b))]
+
+    # "Blue's Clues" shadow fix
+    shadeDefault = 0.66
+    factor = (1.0 / 6.0) - np.abs(shadeDefault - h)
+    shadeDefault = np.where(factor > 0, shadeDefault - factor * 2, shadeDefault)
+    shade = [np.trunc(ch * shadeDefault) for ch in entry]
+
+    h, s, v = _rgb_to_hsv(*shade)
+    h = h - 0.0635
+    h = np.where(h < 0.0, 1.0 + h, h)
+    shade = _hsv_to_rgb(h, s, v)
+
+    return np.stack(
+        [np.stack(entry, axis=-1), np.stack(shade, axis=-1)], axis=-2
+    ).astype(np.uint8)
+
+
+def _pack(rgb: np.ndarray) -> np.ndarray:
+    """Packs the last axis of an RGB uint8 array into single uint32 values."""
+    packed = np.zeros(rgb.shape[:-1] + (4,), dtype=np.uint8)
+    packed[..., :3] = rgb
+    return packed.view(np.uint32)[..., 0]
+
+
+def _unpack(packed: np.ndarray) -> np.ndarray:
+    """Inverse of _pack, returns a view of the RGB channels."""
+    return (
+        np.ascontiguousarray(packed)
+        .view(np.uint8)
+        .reshape(packed.shape + (4,))[..., :3]
+    )
+
+
+def dumpy_reference(imagebytes: bytes, ty: int) -> list[Image.Image]:
+    """Per pixel implementation of dumpy, kept to check the output of the
+    vectorized renderer against."""
+    backgroundimg, inputimage, moguses, layout = _prepare(imagebytes, ty)
+    mox, moy, pad, ix, iy = layout
+    tx = inputimage.width
+
+    # sets up loop vars
+    count1Check = 6
+    count2Reset = 5
+
+    # Actually makes the frames
+    frames: list[Image.Image] = []
+
+    pixelinputimg = inputimage.load()
+    if pixelinputimg is None:
+        raise Exception("Null image")
+
+    for index in range(0, TILE_COUNT):
+        frames.append(backgroundimg.resize((ix, iy)))
+
+        count = index
+        count2 = index
 
         # iterates through pixels
-        for y in range(0, F_ty):
-            for x in range(0, F_tx):
+        for y in range(0, ty):
+            for x in range(0, tx):
                 # Grabs appropriate pixel frame
-                pixel = moguses[count]
-                pixelinputimg = inputimage.load()
-                if pixelinputimg is None:
-                    raise Exception("Null image")
-                pixel = shader(pixel, pixelinputimg[x, y])  # type: ignore
+                pixel = shader(moguses[count], pixelinputimg[x, y])  # type: ignore
                 # overlays it (if not null)
                 if pixel is not None:
                     overlaid_image = overlayImages(
-                        frames[indexx], pixel, (x * moxF) + padF, (y * moyF) + padF
+                        frames[index], pixel, (x * mox) + pad, (y * moy) + pad
                     )
                     if overlaid_image is not None:
-                        frames[indexx] = overlaid_image
+                        frames[index] = overlaid_image
 
                 # Handles animating
                 count += 1
-                if count == F_count1Check:
+                if count == count1Check:
                     count = 0
 
             # Handles line resets
             count2 -= 1
             if count2 == -1:
-                count2 = F_count2Reset
+                count2 = count2Reset
             count = count2
     return frames
 
 
-def shader(t: Image.Image, pRgb: tuple[int, int, int]):
-    c = (197, 17, 17)
-    c2 = (122, 8, 56)
+def shade_colors(
+    pRgb: tuple[int, int, int],
+) -> tuple[tuple[float, float, float], tuple[float, float, float]]:
+    """Works out the body and shadow colour of a crewmate for an input pixel."""
     entry = tuple(map(float, pRgb))
     # brightness check. If the pixel is too dim, the brightness is floored to the
     # standard "black" level.
@@ -144,6 +369,13 @@ def shader(t: Image.Image, pRgb: tuple[int, int, int]):
     if hsb[0] < 0.0:
         hsb[0] = 1.0 + hsb[0]
     shade = colorsys.hsv_to_rgb(hsb[0], hsb[1], hsb[2])
+    return entry, shade  # type: ignore
+
+
+def shader(t: Image.Image, pRgb: tuple[int, int, int]):
+    c = BODY_COLOR
+    c2 = SHADE_COLOR
+    entry, shade = shade_colors(pRgb)
     # fills in img
 
     tmatrix = np.array(t)
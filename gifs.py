@@ -0,0 +1,376 @@
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+import zlib
+from io import BytesIO
+from pathlib import Path
+from typing import IO
+
+import msgspec
+from attrs import define
+from PIL import GifImagePlugin, Image, ImageChops, ImageSequence
+
+from mediacache import MB
+from utils import atomic_open
+
+# decoded frames are kept in memory up to this size, then spill to disk
+SPOOL_BYTES = 32 * MB
+
+# alpha lookup tables, gifs only have fully transparent or opaque pixels
+OPAQUE_LUT = [0] * 128 + [255] * 128
+TRANSPARENT_LUT = [255] + [0] * 255
+
+
+class FrameEntry(msgspec.Struct, array_like=True):
+    """Where a composited frame is stored and how long it is shown."""
+
+    offset: int
+    length: int
+    duration: int
+    has_alpha: bool
+
+
+class FrameHeader(msgspec.Struct, array_like=True):
+    size: tuple[int, int]
+    entries: list[FrameEntry]
+
+
+def _flatten(frame: Image.Image) -> tuple[Image.Image, bool]:
+    """Converts a composited frame to RGBA if it has transparent pixels, or
+    to RGB otherwise.
+    Returns:
+        tuple[Image.Image, bool]: The frame and whether it has transparency."""
+    has_alpha = False
+    if frame.mode == "RGBA" or "transparency" in frame.info:
+        frame = frame.convert("RGBA")
+        has_alpha = frame.getextrema()[3][0] < 255
+    return frame.convert("RGBA" if has_alpha else "RGB"), has_alpha
+
+
+class FrameIndex:
+    """Composited frames of an animation, each compressed separately so any
+    frame can be read back by decoding only that frame.
+
+    Pillow can only seek a gif forward from the start, so building the index
+    decodes every frame once."""
+
+    def __init__(self, fp: IO[bytes], header: FrameHeader, data_offset: int = 0):
+        self.fp = fp
+        self.size = header.size
+        self.entries = header.entries
+        self._data_offset = data_offset
+
+    @classmethod
+    def build(cls, img: Image.Image, fp: IO[bytes]) -> "FrameIndex":
+        """Decodes every frame of img and writes the compressed frames to fp."""
+        entries: list[FrameEntry] = []
+        start = fp.tell()
+        offset = 0
+        for frame in ImageSequence.Iterator(img):
+            duration = frame.info.get("duration", img.info.get("duration", 100))
+            # opaque frames are stored without the alpha channel, a quarter
+            # less data to compress
+            frame, has_alpha = _flatten(frame)
+            data = zlib.compress(frame.tobytes(), 1)
+            fp.write(data)
+            entries.append(FrameEntry(offset, len(data), duration, has_alpha))
+            offset += len(data)
+        return cls(fp, FrameHeader(img.size, entries), start)
+
+    def save(self, path: Path) -> None:
+        """Writes the index to path as its header followed by the frames."""
+        header = msgspec.msgpack.encode(FrameHeader(self.size, self.entries))
+        with atomic_open(path) as out:
+            out.write(len(header).to_bytes(4, "little"))
+            out.write(header)
+            self.fp.seek(self._data_offset)
+            shutil.copyfileobj(self.fp, out)
+
+    @classmethod
+    def open(cls, path: Path) -> "FrameIndex":
+        fp = open(path, "rb")
+        try:
+            header_length = int.from_bytes(fp.read(4), "little")
+            header = msgspec.msgpack.decode(fp.read(header_length), type=FrameHeader)
+        except msgspec.DecodeError:
+            fp.close()
+            raise
+        return cls(fp, header, 4 + header_length)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def has_alpha(self) -> bool:
+        return any(entry.has_alpha for entry in self.entries)
+
+    def frame(self, ii: int) -> Image.Image:
+        """Decodes the composited frame ii, as RGBA if it has transparent
+        pixels or RGB otherwise."""
+        entry = self.entries[ii]
+        self.fp.seek(self._data_offset + entry.offset)
+        data = zlib.decompress(self.fp.read(entry.length))
+        return Image.frombytes("RGBA" if entry.has_alpha else "RGB", self.size, data)
+
+    def close(self) -> None:
+        self.fp.close()
+
+    def __enter__(self) -> "FrameIndex":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class FrameIndexCache:
+    """Frame indexes saved in directory by the hash of the gif, shared by all
+    render workers. The directory is trimmed to max_bytes, least recently
+    used first."""
+
+    def __init__(
+        self, directory: str = "cache/frames", max_bytes: int = 256 * MB
+    ) -> None:
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    def get(self, imgbytes: bytes) -> FrameIndex | None:
+        """Opens the frame index of a gif if it was built already."""
+        path = self._path(imgbytes)
+        try:
+            index = FrameIndex.open(path)
+            os.utime(path)
+            return index
+        except (FileNotFoundError, msgspec.DecodeError):
+            return None
+
+    def open(self, imgbytes: bytes) -> FrameIndex:
+        """Opens the frame index of a gif, building it on the first use."""
+        index = self.get(imgbytes)
+        if index is not None:
+            return index
+
+        path = self._path(imgbytes)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        gif = Image.open(BytesIO(imgbytes))
+        with tempfile.TemporaryFile() as fp:
+            FrameIndex.build(gif, fp).save(path)
+        self._trim()
+        return FrameIndex.open(path)
+
+    def _path(self, imgbytes: bytes) -> Path:
+        return self.directory / hashlib.sha256(imgbytes).hexdigest()
+
+    def _trim(self) -> None:
+        entries = sorted(
+            (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+            for entry in os.scandir(self.directory)
+            if entry.is_file() and not entry.name.endswith(".tmp")
+        )
+        total = sum(size for _, size, _ in entries)
+        # the newest index is always kept
+        for _, size, path in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            Path(path).unlink(missing_ok=True)
+            total -= size
+
+
+frame_indexes = FrameIndexCache()
+
+
+def random_frame(imgbytes: bytes, reroll: bool = False) -> bytes:
+    """Picks a random frame of a gif as a png.
+
+    Without an index the gif is decoded up to the picked frame, which is
+    faster than building the index for a gif picked from only once. The
+    index is built on the first reroll, then only the picked frame is decoded.
+    Args:
+        imgbytes (bytes): The gif.
+        reroll (bool): Whether the gif was picked from before.
+    Returns:
+        bytes: The picked frame."""
+    index = frame_indexes.open(imgbytes) if reroll else frame_indexes.get(imgbytes)
+    if index is not None:
+        with index:
+            frame = index.frame(random.randrange(len(index)))
+    else:
+        gif = Image.open(BytesIO(imgbytes))
+        gif.seek(random.randrange(getattr(gif, "n_frames", 1)))
+        frame, _ = _flatten(gif)
+    with BytesIO() as image_binary:
+        frame.save(image_binary, "PNG")
+        return image_binary.getvalue()
+
+
+def _to_palette(img: Image.Image) -> tuple[Image.Image, int | None]:
+    """Quantizes a frame to at most 256 colors, or 255 and an extra index for
+    fully transparent pixels.
+
+    Frames with few colors, like every frame of a gif, keep their exact
+    colors, others are quantized with a fast octree."""
+    rgb = img.convert("RGB")
+    max_colors = 255 if img.mode == "RGBA" else 256
+    colors = rgb.getcolors(max_colors)
+    if colors is not None:
+        palette = Image.new("P", (1, 1))
+        palette.putpalette([channel for _, color in colors for channel in color])
+        p_img = rgb.quantize(palette=palette, dither=Image.Dither.NONE)
+    else:
+        p_img = rgb.quantize(max_colors, Image.Quantize.FASTOCTREE)
+    palette_data = (p_img.getpalette() or [])[: max_colors * 3]
+
+    transparency = None
+    if img.mode == "RGBA":
+        transparent = img.getchannel("A").point(TRANSPARENT_LUT)
+        if transparent.getbbox() is not None:
+            transparency = len(palette_data) // 3
+            p_img.paste(transparency, mask=transparent)
+            palette_data += [0, 0, 0]
+    # the color table of each frame is only as large as it needs to be
+    p_img.putpalette(palette_data)
+    return p_img, transparency
+
+
+@define
+class PendingFrame:
+    region: Image.Image
+    offset: tuple[int, int]
+    duration: int
+    disposal: int = 1
+
+    @property
+    def box(self) -> tuple[int, int, int, int]:
+        x, y = self.offset
+        return (x, y, x + self.region.width, y + self.region.height)
+
+
+def _union(a: tuple[int, ...], b: tuple[int, ...]) -> tuple[int, int, int, int]:
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+class GifWriter:
+    """Encodes a gif one frame at a time.
+
+    Pillow's encoder keeps every frame until the whole gif is written, here
+    only the previous frame is kept. Frames are cropped to the area that
+    changed, frames identical to the previous one extend its duration.
+    When pixels become transparent again the previous frame is cleared to
+    the background after it is shown."""
+
+    def __init__(
+        self, fp: IO[bytes], size: tuple[int, int], loop: int = 0, alpha: bool = False
+    ) -> None:
+        self.fp = fp
+        self.size = size
+        self.loop = loop
+        self.alpha = alpha
+        self._previous: Image.Image | None = None
+        # frame waiting for its duration and disposal to be known
+        self._pending: PendingFrame | None = None
+        self._header_written = False
+
+    def add(self, frame: Image.Image, duration: int) -> None:
+        frame = frame.convert("RGBA" if self.alpha else "RGB")
+        if self.alpha:
+            alpha = frame.getchannel("A").point(OPAQUE_LUT)
+            frame.putalpha(alpha)
+
+        previous, pending = self._previous, self._pending
+        self._previous = frame
+        if previous is None or pending is None:
+            self._pending = PendingFrame(frame, (0, 0), duration)
+            return
+
+        bbox = ImageChops.difference(previous, frame).getbbox()
+        if bbox is None:
+            pending.duration += duration
+            return
+
+        cleared = self.alpha and (
+            ImageChops.subtract(previous.getchannel("A"), frame.getchannel("A"))
+            .crop(bbox)
+            .getbbox()
+        )
+        if cleared:
+            # pixels only become transparent when the previous frame is
+            # disposed to the background, so it is extended over them and
+            # the next frame redraws everything that was cleared
+            cleared = (
+                cleared[0] + bbox[0],
+                cleared[1] + bbox[1],
+                cleared[2] + bbox[0],
+                cleared[3] + bbox[1],
+            )
+            disposed = _union(pending.box, cleared)
+            pending.region = previous.crop(disposed)
+            pending.offset = disposed[:2]
+            pending.disposal = 2
+            bbox = _union(disposed, bbox)
+        self._flush()
+        self._pending = PendingFrame(frame.crop(bbox), bbox[:2], duration)
+
+    def _flush(self) -> None:
+        pending = self._pending
+        if pending is None:
+            return
+        self._pending = None
+
+        p_img, transparency = _to_palette(pending.region)
+        if not self._header_written:
+            # the first frame always covers the whole canvas
+            header, _ = GifImagePlugin.getheader(p_img, info={"loop": self.loop})
+            for chunk in header:
+                self.fp.write(chunk)
+            self._header_written = True
+
+        params: dict = {
+            "duration": pending.duration,
+            "disposal": pending.disposal,
+            "include_color_table": True,
+        }
+        if transparency is not None:
+            params["transparency"] = transparency
+        for chunk in GifImagePlugin.getdata(p_img, pending.offset, **params):
+            self.fp.write(chunk)
+
+    def close(self) -> None:
+        self._flush()
+        self.fp.write(b";")
+
+
+def apng_to_gif(imagebytes: bytes) -> bytes:
+    """Converts an animated png to a gif without touching the disk, frames
+    are decoded and encoded one at a time.
+    Args:
+        imagebytes (bytes): The animated png.
+    Returns:
+        bytes: The gif, with a transparent color if the png had transparency."""
+    png = Image.open(BytesIO(imagebytes))
+    alpha = png.mode in ("RGBA", "LA", "PA") or "transparency" in png.info
+    with BytesIO() as gif_binary:
+        writer = GifWriter(gif_binary, png.size, png.info.get("loop", 0), alpha)
+        for frame in ImageSequence.Iterator(png):
+            writer.add(frame, frame.info.get("duration", 100))
+        writer.close()
+        return gif_binary.getvalue()
+
+
+def reverse_gif(imgbytes: bytes, spool_bytes: int = SPOOL_BYTES) -> bytes:
+    """Plays a gif backwards, keeping the duration of every frame.
+    Args:
+        imgbytes (bytes): The gif to reverse.
+        spool_bytes (int): Compressed frames kept in memory before using disk.
+    Returns:
+        bytes: The reversed gif."""
+    gif = Image.open(BytesIO(imgbytes))
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+    with FrameIndex.build(gif, spool) as index, BytesIO() as gif_binary:
+        writer = GifWriter(
+            gif_binary, index.size, gif.info.get("loop", 0), index.has_alpha
+        )
+        for ii in reversed(range(len(index))):
+            writer.add(index.frame(ii), index.entries[ii].duration)
+        writer.close()
+        return gif_binary.getvalue()
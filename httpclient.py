@@ -0,0 +1,111 @@
+import asyncio
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from importlib.util import find_spec
+
+import httpx2
+from attrs import define
+
+
+@define
+class HostStats:
+    """Request counters of a single host."""
+
+    requests: int = 0
+    new_connections: int = 0
+    errors: int = 0
+    total_latency: float = 0.0
+    max_latency: float = 0.0
+
+    @property
+    def reused_connections(self) -> int:
+        return self.requests - self.new_connections
+
+    @property
+    def mean_latency(self) -> float:
+        return self.total_latency / self.requests if self.requests else 0.0
+
+
+class HttpClient:
+    """Async HTTP client shared by every outbound request of the bot.
+
+    Keeps connections and TLS sessions alive between requests, limits the
+    number of concurrent connections per host and records the latency and
+    connection reuse of every host in stats."""
+
+    def __init__(self, max_connections_per_host: int = 10, timeout: float = 120):
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout = timeout
+        self.stats: dict[str, HostStats] = {}
+        self._client: httpx2.AsyncClient | None = None
+        self._host_limits: dict[str, asyncio.Semaphore] = {}
+
+    def _get_client(self) -> httpx2.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx2.AsyncClient(
+                # http2 needs the optional h2 package
+                http2=find_spec("h2") is not None,
+                timeout=self.timeout,
+                limits=httpx2.Limits(max_keepalive_connections=50, keepalive_expiry=60),
+            )
+        return self._client
+
+    async def start(self) -> None:
+        self._get_client()
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @asynccontextmanager
+    async def stream(
+        self, method: str, url: str, **kwargs
+    ) -> AsyncIterator[httpx2.Response]:
+        """Sends a request and yields the response before its body is read."""
+        host = httpx2.URL(url).host
+        stats = self.stats.setdefault(host, HostStats())
+        limit = self._host_limits.setdefault(
+            host, asyncio.Semaphore(self.max_connections_per_host)
+        )
+        new_connection = False
+
+        async def trace(event: str, info: dict) -> None:
+            nonlocal new_connection
+            if event == "connection.connect_tcp.started":
+                new_connection = True
+
+        async with limit:
+            start = time.perf_counter()
+            try:
+                async with self._get_client().stream(
+                    method, url, extensions={"trace": trace}, **kwargs
+                ) as response:
+                    latency = time.perf_counter() - start
+                    stats.requests += 1
+                    stats.new_connections += new_connection
+                    stats.total_latency += latency
+                    stats.max_latency = max(stats.max_latency, latency)
+                    yield response
+            except httpx2.HTTPError:
+                stats.errors += 1
+                raise
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx2.Response:
+        """Sends a request and reads the whole response body."""
+        async with self.stream(method, url, **kwargs) as response:
+            await response.aread()
+        return response
+
+    async def get(self, url: str, **kwargs) -> httpx2.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx2.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def head(self, url: str, **kwargs) -> httpx2.Response:
+        return await self.request("HEAD", url, **kwargs)
+
+
+http_client = HttpClient()
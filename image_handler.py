@@ -1,6 +1,6 @@
+import asyncio
 import os
 from abc import ABC
-from datetime import datetime
 from pathlib import Path
 from urllib.parse import urlparse
 
@@ -8,19 +8,17 @@ import discord
 import httpx2
 import msgspec
 from attrs import define, field
+from PIL import Image, ImageFile
 
-
-class DownsizedSmall(msgspec.Struct):
-    height: str
-    width: str
-    mp4_size: str
-    mp4: str
+from httpclient import http_client
+from mediacache import MB, media_cache
+from metrics import CallbackMetric, phase, registry
+from utils import atomic_write_bytes
 
 
+# only the fields used from a giphy api response, the rest is skipped while
+# decoding
 class GiphyImage(msgspec.Struct):
-    height: str
-    width: str
-    size: str
     url: str
 
 
@@ -29,35 +27,159 @@ class Images(msgspec.Struct):
 
 
 class Data(msgspec.Struct):
-    type: str
-    id: str
-    url: str
-    slug: str
-    bitly_gif_url: str
-    bitly_url: str
-    embed_url: str
-    username: str
-    source: str
-    title: str
-    rating: str
-    content_url: str
-    source_tld: str
-    source_post_url: str
-    is_sticker: int
-    import_datetime: datetime
-    trending_datetime: datetime
     images: Images
 
 
-class Meta(msgspec.Struct):
-    status: int
-    msg: str
-    response_id: str
-
-
 class GiphyAPIResponse(msgspec.Struct):
     data: Data
-    meta: Meta
+
+
+giphy_decoder = msgspec.json.Decoder(GiphyAPIResponse)
+
+
+# leading bytes of the file formats accepted for each filetype
+MAGIC_BYTES: dict[str, tuple[bytes, ...]] = {
+    "gif": (b"GIF87a", b"GIF89a"),
+    "png": (b"\x89PNG\r\n\x1a\n",),
+    "image": (
+        b"GIF87a",
+        b"GIF89a",
+        b"\x89PNG\r\n\x1a\n",
+        b"\xff\xd8\xff",
+        b"RIFF",
+        b"BM",
+        b"II*\x00",
+        b"MM\x00*",
+    ),
+}
+
+DEFAULT_MAX_BYTES = 25 * MB
+# how much of a download is fed to the image parser to find the image size
+HEADER_BYTES = 64 * 1024
+
+# the media cache keeps its own counts, they are read when /metrics is scraped
+registry.register(
+    CallbackMetric(
+        "memebot_media_cache_requests_total",
+        "Lookups in the media cache by result, memory hit, disk hit or miss.",
+        ("result",),
+        lambda: {
+            ("memory_hit",): media_cache.stats.memory_hits,
+            ("disk_hit",): media_cache.stats.disk_hits,
+            ("miss",): media_cache.stats.misses,
+        },
+        kind="counter",
+    )
+)
+registry.register(
+    CallbackMetric(
+        "memebot_media_cache_evictions_total",
+        "Files evicted from each tier of the media cache to make room.",
+        ("tier",),
+        lambda: {(tier,): count for tier, count in media_cache.evictions().items()},
+        kind="counter",
+    )
+)
+registry.register(
+    CallbackMetric(
+        "memebot_media_cache_bytes",
+        "Bytes held by each tier of the media cache.",
+        ("tier",),
+        lambda: {(tier,): size for tier, size in media_cache.sizes().items()},
+    )
+)
+
+
+def check_magic(header: bytes, filetype: str) -> bool:
+    """Checks that the leading bytes of a file match the expected filetype."""
+    return header.startswith(MAGIC_BYTES.get(filetype, (b"",)))
+
+
+async def read_response(
+    response: httpx2.Response, max_bytes: int, filetype: str | None = None
+) -> bytes:
+    """Reads the body of a streamed response without buffering more than max_bytes.
+    Args:
+        response (httpx2.Response): Response opened with http_client.stream.
+        max_bytes (int): Size limit of the body.
+        filetype (str | None): Expected filetype, checked against the file signature.
+    Returns:
+        bytes: The response body.
+    Raises:
+        ValueError: If the file is too large or not of the expected filetype."""
+    too_large = f"file must be smaller than {max_bytes / MB:g} MB"
+    content_length = response.headers.get("Content-Length", "")
+    if content_length.isdigit() and int(content_length) > max_bytes:
+        raise ValueError(too_large)
+
+    # the image header is parsed while the rest of the file downloads, so
+    # images with too many pixels to decode are rejected early
+    parser: ImageFile.Parser | None = ImageFile.Parser()
+    chunks: list[bytes] = []
+    received = 0
+    header = b""
+    async for chunk in response.aiter_bytes():
+        received += len(chunk)
+        if received > max_bytes:
+            raise ValueError(too_large)
+        chunks.append(chunk)
+
+        if filetype is not None and len(header) < 16:
+            header = b"".join(chunks)[:16]
+            if len(header) == 16 and not check_magic(header, filetype):
+                raise ValueError(f"link must redirect to a {filetype}")
+
+        if parser is not None:
+            try:
+                parser.feed(chunk)
+            except Image.DecompressionBombError:
+                raise ValueError("image dimensions are too large")
+            except Exception:
+                parser = None
+                continue
+            if parser.image is not None:
+                width, height = parser.image.size
+                parser = None
+                if width * height > (Image.MAX_IMAGE_PIXELS or width * height):
+                    raise ValueError("image dimensions are too large")
+            elif received > HEADER_BYTES:
+                parser = None
+
+    if filetype is not None and not check_magic(header, filetype):
+        raise ValueError(f"link must redirect to a {filetype}")
+    return b"".join(chunks)
+
+
+def check_cached(content: bytes, max_bytes: int, filetype: str | None = None):
+    """Applies the checks of read_response to content taken from the cache."""
+    if len(content) > max_bytes:
+        raise ValueError(f"file must be smaller than {max_bytes / MB:g} MB")
+    if filetype is not None and not check_magic(content[:16], filetype):
+        raise ValueError(f"link must redirect to a {filetype}")
+
+
+async def download(
+    url: str, max_bytes: int = DEFAULT_MAX_BYTES, key: str | None = None
+) -> bytes:
+    """Downloads a file through the shared client, limited to max_bytes.
+    Args:
+        url (str): Url of the file.
+        max_bytes (int): Size limit of the file.
+        key (str | None): Media cache key, defaults to the normalized url.
+    Returns:
+        bytes: The file content, from the media cache if it was seen before."""
+    key = key or media_cache.url_key(url)
+    with phase("download"):
+        content = await media_cache.get(key)
+        if content is not None:
+            check_cached(content, max_bytes)
+            return content
+
+        async with http_client.stream("GET", url) as response:
+            content = await read_response(response, max_bytes)
+            if response.is_success:
+                await media_cache.put(key, content)
+        return content
 
 
 @define
@@ -65,13 +187,10 @@ class DiscordImage(ABC):
     filetype: str
     url: str = field(init=False)
     filename: str = field(init=False)
+    max_bytes: int = field(default=DEFAULT_MAX_BYTES, kw_only=True)
 
     async def get_image_bytes(self) -> bytes:
-        async with httpx2.AsyncClient() as client:
-            response = await client.get(self.url)
-
-        imgbytes = response.content
-        return imgbytes
+        return await download(self.url, self.max_bytes)
 
     def get_filename(self) -> str:
         return self.filename
@@ -90,6 +209,12 @@ class FileImage(DiscordImage):
             raise ValueError("Unknown file type")
         elif self.filetype not in value.content_type:
             raise ValueError(f"file must be a {self.filetype}")
+        elif value.size > self.max_bytes:
+            raise ValueError(f"file must be smaller than {self.max_bytes / MB:g} MB")
+
+    async def get_image_bytes(self) -> bytes:
+        # attachment ids never point to different content
+        return await download(self.url, self.max_bytes, f"attachment:{self.file.id}")
 
     def __attrs_post_init__(self):
         self.url = self.file.url
@@ -99,18 +224,34 @@ class FileImage(DiscordImage):
 @define
 class UrlImage(DiscordImage):
     link: str = field()
+    content: bytes | None = field(init=False, default=None)
 
-    @link.validator
-    def _check_link(self, attribute, value: str):
-        response = httpx2.head(value)
+    async def validate(self) -> None:
+        """Checks that the link points to the right filetype using a single GET
+        request, the downloaded body is kept for get_image_bytes."""
+        key = media_cache.url_key(self.link)
+        content = await media_cache.get(key)
+        if content is not None:
+            check_cached(content, self.max_bytes, self.filetype)
+            self.content = content
+            return
 
-        if response.status_code < 200 or response.status_code > 300:
-            raise ValueError("Invalid url, returned non 200 status code")
+        async with http_client.stream("GET", self.link) as response:
+            if response.status_code < 200 or response.status_code > 300:
+                raise ValueError("Invalid url, returned non 200 status code")
 
-        content_type = response.headers["Content-Type"]
+            content_type = response.headers.get("Content-Type", "")
 
-        if self.filetype not in content_type:
-            raise ValueError(f"link must redirect to a {self.filetype}")
+            if self.filetype not in content_type:
+                raise ValueError(f"link must redirect to a {self.filetype}")
+
+            self.content = await read_response(response, self.max_bytes, self.filetype)
+        await media_cache.put(key, self.content)
+
+    async def get_image_bytes(self) -> bytes:
+        if self.content is None:
+            await self.validate()
+        return self.content  # type: ignore
 
     def __attrs_post_init__(self):
         self.url = self.link
@@ -118,7 +259,10 @@ class UrlImage(DiscordImage):
 
 
 async def create_image_class(
-    file: discord.Attachment | None, link: str, filetype: str
+    file: discord.Attachment | None,
+    link: str,
+    filetype: str,
+    max_bytes: int = DEFAULT_MAX_BYTES,
 ) -> DiscordImage:
     """Constructs a DiscordImage class based on file or link input."""
 
@@ -127,7 +271,7 @@ async def create_image_class(
         raise ValueError("Must specify exactly one of file or link argument")
 
     if file is not None:
-        return FileImage(file=file, filetype=filetype)
+        return FileImage(file=file, filetype=filetype, max_bytes=max_bytes)
     else:
         # handle giphy links
         if "giphy.com/gifs" in link:
@@ -139,29 +283,64 @@ async def create_image_class(
         if "tenor.com" in link and (link.endswith(".mp4") or link.endswith(".webm")):
             raise ValueError("link must redirect to a gif")
 
-        return UrlImage(link=link, filetype=filetype)
+        image = UrlImage(link=link, filetype=filetype, max_bytes=max_bytes)
+        await image.validate()
+        return image
 
 
-async def giphysearch(url: str) -> str:
-    """Searches for a gif using giphy api"""
-    api_key = os.getenv("GIPHY_API_KEY")
+class GiphyResolver:
+    """Resolves giphy links to gif urls, giphy ids never change so resolved
+    urls are saved to path and kept across restarts."""
 
-    if api_key is None:
-        print("GIPHY_API_KEY is not set")
-        raise ValueError("GIPHY api key is missing")
+    def __init__(self, path: str = "cache/giphy.msgpack") -> None:
+        self.path = Path(path)
+        self._urls: dict[str, str] | None = None
 
-    gif_id = url.split("-")[-1]
-    params = {"api_key": api_key}
+    def _load(self) -> dict[str, str]:
+        try:
+            return msgspec.msgpack.decode(self.path.read_bytes(), type=dict[str, str])
+        except (FileNotFoundError, msgspec.DecodeError):
+            return {}
 
-    async with httpx2.AsyncClient() as client:
-        r = await client.get(f"https://api.giphy.com/v1/gifs/{gif_id}", params=params)
+    def _save(self, urls: dict[str, str]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_bytes(self.path, msgspec.msgpack.encode(urls))
+
+    async def resolve(self, url: str) -> str:
+        """Returns the url of the medium sized gif of a giphy link."""
+        if self._urls is None:
+            self._urls = await asyncio.to_thread(self._load)
+
+        gif_id = urlparse(url).path.rstrip("/").split("/")[-1].split("-")[-1]
+        gif_url = self._urls.get(gif_id)
+        if gif_url is not None:
+            return gif_url
+
+        api_key = os.getenv("GIPHY_API_KEY")
+
+        if api_key is None:
+            print("GIPHY_API_KEY is not set")
+            raise ValueError("GIPHY api key is missing")
+
+        params = {"api_key": api_key}
+
+        r = await http_client.get(
+            f"https://api.giphy.com/v1/gifs/{gif_id}", params=params
+        )
+
+        if r.status_code != 200:
+            raise ValueError("Non 200 status code for giphy api")
 
-    if r.status_code == 200:
-        decoder = msgspec.json.Decoder(type=GiphyAPIResponse)
         # load the GIFs using the urls for the medium GIF sizes
-        response = decoder.decode(r.content)
-        giphy_url = response.data.images.downsized_medium.url
-        return giphy_url
+        gif_url = giphy_decoder.decode(r.content).data.images.downsized_medium.url
+        self._urls[gif_id] = gif_url
+        await asyncio.to_thread(self._save, dict(self._urls))
+        return gif_url
 
-    else:
-        raise ValueError("Non 200 status code for giphy api")
+
+giphy_resolver = GiphyResolver()
+
+
+async def giphysearch(url: str) -> str:
+    """Searches for a gif using giphy api"""
+    return await giphy_resolver.resolve(url)
@@ -0,0 +1,87 @@
+import asyncio
+from html.parser import HTMLParser
+from urllib.parse import quote_plus
+
+from httpclient import http_client
+from utils import LRUCache
+
+KYM_URL = "https://knowyourmeme.com"
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/106.0.0.0 Safari/537.36"
+}
+
+
+def is_result_link(href: str, classes: list[str]) -> bool:
+    return (
+        "/memes/" in href
+        and len(href.split("/")) == 3
+        and "=" not in href
+        and classes == ["item"]
+    )
+
+
+class ResultLinkParser(HTMLParser):
+    """Collects result links while the page is tokenized, without building
+    a tree of the page."""
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=False)
+        self.links: list[str] = []
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        if tag != "a":
+            return
+        attributes = dict(attrs)
+        href = attributes.get("href") or ""
+        classes = (attributes.get("class") or "").split()
+        if is_result_link(href, classes):
+            self.links.append(f"{KYM_URL}{href}")
+
+
+def normalize_query(query: str) -> str:
+    """Lowercases a query and collapses whitespace so equivalent searches
+    share a cache entry."""
+    return " ".join(query.lower().split())
+
+
+def parse_search_page(html: bytes | str) -> list[str]:
+    """Collects the meme links of a know your meme search page.
+    Args:
+        html (bytes | str): The search page.
+    Returns:
+        list[str]: Absolute links of the results in page order, without duplicates.
+    """
+    if isinstance(html, bytes):
+        html = html.decode(errors="replace")
+    parser = ResultLinkParser()
+    parser.feed(html)
+    parser.close()
+    return list(dict.fromkeys(parser.links))
+
+
+class KymSearch:
+    """Searches know your meme, keeping results of recent queries for ttl
+    seconds."""
+
+    def __init__(self, ttl: float = 3600, max_entries: int = 256) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._cache: LRUCache[str, list[str]] = LRUCache(max_entries, ttl=ttl)
+
+    async def search(self, query: str) -> list[str]:
+        key = normalize_query(query)
+        links = self._cache.get(key)
+        if links is not None:
+            return links
+
+        url = f"{KYM_URL}/search?q={quote_plus(key)}"
+        resp = await http_client.get(url, headers=HEADERS)
+        resp.raise_for_status()
+        # parsing a full page takes long enough to stall the event loop
+        links = await asyncio.to_thread(parse_search_page, resp.content)
+
+        self._cache.put(key, links)
+        return links
+
+
+kym_search = KymSearch()
@@ -5,7 +5,10 @@ from collections.abc import Callable
 
 import discord
 
-from utils import memerequest, seekrandomframe
+from metrics import phase, track_command
+from render import caption_job, random_frame_job
+from tracing import span
+from utils import with_format_suffix
 
 
 class ScrollerButton(discord.ui.ActionRow):
@@ -75,9 +78,9 @@ class ScrollerV2(discord.ui.LayoutView):
 
 
 class Form(discord.ui.Modal, title="Form"):
-    def __init__(self, url: str, filename) -> None:
+    def __init__(self, background: bytes, filename) -> None:
         super().__init__()
-        self.background = url
+        self.background = background
         self.filename = filename
 
     text: discord.ui.TextInput = discord.ui.TextInput(
@@ -87,17 +90,29 @@ class Form(discord.ui.Modal, title="Form"):
 
     async def on_submit(self, interaction: discord.Interaction):
         """Handles the submission of the form to generate a meme."""
-        imagebytes = await memerequest(self.background, self.text.value)
-        await interaction.response.send_message(
-            file=discord.File(fp=BytesIO(imagebytes), filename=self.filename),
-        )
+        with track_command("caption_form"), span("caption_form"):
+            await interaction.response.defer()
+            render = interaction.client.render  # type: ignore
+            imagebytes, image_format = await render.submit(
+                caption_job, self.background, self.text.value
+            )
+            filename = with_format_suffix(self.filename, image_format)
+            with phase("upload"):
+                await interaction.followup.send(
+                    file=discord.File(fp=BytesIO(imagebytes), filename=filename),
+                )
 
     async def on_error(
         self, interaction: discord.Interaction, error: Exception
     ) -> None:
-        await interaction.response.send_message(
-            "Oops! Something went wrong.", ephemeral=True
-        )
+        if interaction.response.is_done():
+            await interaction.followup.send(
+                "Oops! Something went wrong.", ephemeral=True
+            )
+        else:
+            await interaction.response.send_message(
+                "Oops! Something went wrong.", ephemeral=True
+            )
 
         # Make sure we know what the error actually is
         traceback.print_exception(type(error), error)
@@ -116,9 +131,9 @@ class EditViewButton(discord.ui.ActionRow):
 
 
 class EditView(discord.ui.LayoutView):
-    def __init__(self, url: str, filename: str, imagebytes: bytes) -> None:
+    def __init__(self, background: bytes, filename: str, imagebytes: bytes) -> None:
         super().__init__(timeout=60)
-        self.background = url
+        self.background = background
         self.filename = filename
         self.message = None
 
@@ -145,11 +160,19 @@ class RerollButton(discord.ui.ActionRow):
     @discord.ui.button(style=discord.ButtonStyle.gray, label="Reroll")
     async def reroll(self, interaction: discord.Interaction, button: discord.ui.Button):
         """Rerolls to get a different frame from the image bytes."""
-        image_binary = seekrandomframe(self.__view.imgbytes)
-        output_file = discord.File(fp=image_binary, filename=self.__view.filename)
-        await interaction.response.send_message(
-            content=interaction.user.mention, file=output_file
-        )
+        with track_command("reroll"), span("reroll"):
+            # a busy render pool can take longer than discord waits for the
+            # response of an interaction
+            await interaction.response.defer()
+            render = interaction.client.render  # type: ignore
+            image_binary = BytesIO(
+                await render.submit(random_frame_job, self.__view.imgbytes, True)
+            )
+            output_file = discord.File(fp=image_binary, filename=self.__view.filename)
+            with phase("upload"):
+                await interaction.followup.send(
+                    content=interaction.user.mention, file=output_file
+                )
 
 
 class RerollView(discord.ui.LayoutView):
@@ -0,0 +1,12 @@
+# main.py
+"""Starts the bot.
+
+The render workers are spawned processes, which import the main module
+again. bot.py reads the config, creates the client and registers every
+command when it is imported, so it is only imported here when this file is
+run as a script and not in the workers."""
+
+if __name__ == "__main__":
+    from bot import main
+
+    main()
@@ -0,0 +1,205 @@
+import asyncio
+import hashlib
+import mmap
+import os
+import threading
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from attrs import define
+
+from utils import LRUCache, atomic_write_bytes
+
+MB = 1024 * 1024
+
+# query parameters of signed discord cdn links that change for the same file
+DISCORD_CDN_HOSTS = ("cdn.discordapp.com", "media.discordapp.net")
+DISCORD_SIGNATURE_PARAMS = ("ex", "is", "hm")
+
+
+@define
+class CacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+
+
+class MediaCache:
+    """Two tier cache of downloaded media.
+
+    Files are stored by the sha256 of their content, so the same file linked
+    from different places is only kept once. A key (normalized url or
+    attachment id) maps to the hash of its content. Recently used files are
+    kept in memory up to memory_bytes, all files are written to directory
+    which is trimmed to disk_bytes, least recently used first."""
+
+    def __init__(
+        self,
+        directory: str = "cache/media",
+        memory_bytes: int = 64 * MB,
+        disk_bytes: int = 512 * MB,
+    ) -> None:
+        self.directory = Path(directory)
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.stats = CacheStats()
+        self._keys: LRUCache[str, str] = LRUCache(max_entries=10000)
+        self._memory: LRUCache[str, bytes] = LRUCache(max_size=memory_bytes)
+        # sizes of the blobs on disk by content hash
+        self._disk: LRUCache[str, int] | None = None
+        # index files by the content hash they point to, and the other way
+        # around, so evicting a blob also removes the keys that led to it
+        self._index_names: dict[str, set[str]] = {}
+        self._index_hashes: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def url_key(url: str) -> str:
+        """Normalizes a url so that links to the same file share a key."""
+        parts = urlsplit(url.strip())
+        query = parse_qsl(parts.query, keep_blank_values=True)
+        host = parts.netloc.lower()
+        if host in DISCORD_CDN_HOSTS:
+            query = [(k, v) for k, v in query if k not in DISCORD_SIGNATURE_PARAMS]
+        return urlunsplit(
+            (parts.scheme.lower(), host, parts.path, urlencode(sorted(query)), "")
+        )
+
+    async def get(self, key: str) -> bytes | None:
+        """Returns the cached content of a key, or None on a miss."""
+        content_hash = self._keys.get(key)
+        content = self._memory.get(content_hash) if content_hash else None
+        if content is not None:
+            self.stats.memory_hits += 1
+            return content
+
+        result = await asyncio.to_thread(self._disk_get, key)
+        if result is None:
+            self.stats.misses += 1
+            return None
+
+        content_hash, content = result
+        self.stats.disk_hits += 1
+        self._remember(key, content_hash, content)
+        return content
+
+    async def put(self, key: str, content: bytes) -> None:
+        """Stores the content of a key in both tiers."""
+        content_hash = hashlib.sha256(content).hexdigest()
+        self._remember(key, content_hash, content)
+        await asyncio.to_thread(self._disk_put, key, content_hash, content)
+
+    def _remember(self, key: str, content_hash: str, content: bytes) -> None:
+        self._keys.put(key, content_hash)
+        self._memory.put(content_hash, content)
+
+    def evictions(self) -> dict[str, int]:
+        """Number of files evicted from each tier to make room."""
+        return {
+            "memory": self._memory.evictions,
+            "disk": self._disk.evictions if self._disk is not None else 0,
+        }
+
+    def sizes(self) -> dict[str, int]:
+        """Bytes of content held by each tier."""
+        return {
+            "memory": self._memory.size,
+            "disk": self._disk.size if self._disk is not None else 0,
+        }
+
+    @staticmethod
+    def _index_name(key: str) -> str:
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _blob_path(self, content_hash: str) -> Path:
+        return self.directory / "blobs" / content_hash
+
+    def _link(self, name: str, content_hash: str) -> None:
+        """Records that the index file name points to content_hash."""
+        previous = self._index_hashes.get(name)
+        if previous is not None and previous != content_hash:
+            self._index_names[previous].discard(name)
+        self._index_hashes[name] = content_hash
+        self._index_names.setdefault(content_hash, set()).add(name)
+
+    def _unlink(self, name: str) -> None:
+        """Removes the index file name."""
+        content_hash = self._index_hashes.pop(name, None)
+        if content_hash is not None:
+            self._index_names[content_hash].discard(name)
+        (self.directory / "index" / name).unlink(missing_ok=True)
+
+    def _evict_blob(self, content_hash: str, size: int) -> None:
+        self._blob_path(content_hash).unlink(missing_ok=True)
+        for name in self._index_names.pop(content_hash, set()):
+            self._index_hashes.pop(name, None)
+            (self.directory / "index" / name).unlink(missing_ok=True)
+
+    def _load_disk(self) -> LRUCache[str, int]:
+        """Scans the blobs on disk, ordered from least to most recently used,
+        and the index files pointing to them."""
+        if self._disk is None:
+            (self.directory / "index").mkdir(parents=True, exist_ok=True)
+            (self.directory / "blobs").mkdir(parents=True, exist_ok=True)
+            blobs = sorted(
+                (entry.stat().st_mtime, entry.name, entry.stat().st_size)
+                for entry in os.scandir(self.directory / "blobs")
+                if entry.is_file() and not entry.name.endswith(".tmp")
+            )
+            self._disk = LRUCache(
+                max_size=self.disk_bytes,
+                sizeof=lambda size: size,
+                on_evict=self._evict_blob,
+            )
+            for _, name, size in blobs:
+                self._disk.put(name, size)
+            for entry in os.scandir(self.directory / "index"):
+                if not entry.is_file() or entry.name.endswith(".tmp"):
+                    continue
+                content_hash = Path(entry.path).read_text()
+                if content_hash in self._disk:
+                    self._link(entry.name, content_hash)
+                else:
+                    # left behind by a blob removed outside the cache
+                    os.unlink(entry.path)
+        return self._disk
+
+    def _disk_get(self, key: str) -> tuple[str, bytes] | None:
+        with self._lock:
+            disk = self._load_disk()
+            name = self._index_name(key)
+            content_hash = self._index_hashes.get(name)
+            if content_hash is None:
+                return None
+            size = disk.get(content_hash)
+            if size is None:
+                self._unlink(name)
+                return None
+
+            path = self._blob_path(content_hash)
+            with open(path, "rb") as fp:
+                if size == 0:
+                    content = b""
+                else:
+                    with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        content = mm[:]
+            os.utime(path)
+            return content_hash, content
+
+    def _disk_put(self, key: str, content_hash: str, content: bytes) -> None:
+        with self._lock:
+            disk = self._load_disk()
+            if len(content) > self.disk_bytes:
+                return
+            if disk.get(content_hash) is None:
+                atomic_write_bytes(self._blob_path(content_hash), content)
+            disk.put(content_hash, len(content))
+            name = self._index_name(key)
+            if self._index_hashes.get(name) != content_hash:
+                atomic_write_bytes(
+                    self.directory / "index" / name, content_hash.encode()
+                )
+                self._link(name, content_hash)
+
+
+media_cache = MediaCache()
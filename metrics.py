@@ -0,0 +1,302 @@
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, TypeVar
+
+from tracing import span
+
+# aiohttp is only imported by the bot process when it starts the server, the
+# render workers record their phases too
+if TYPE_CHECKING:
+    from aiohttp import web
+
+# name of the command the current task is running, set by timer_function
+current_command_name: ContextVar[str] = ContextVar(
+    "current_command_name", default="other"
+)
+
+# outcome the running command is counted with, commands that catch their
+# errors and reply to the user themselves change it with set_outcome
+current_command_outcome: ContextVar[str] = ContextVar(
+    "current_command_outcome", default="ok"
+)
+
+# upper bounds in seconds, from a cache hit to a long gif render
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return f"{{{pairs}}}"
+
+
+class Metric(ABC):
+    """A metric with one value per combination of label values.
+
+    Values are plain floats in a dict, only touched from the event loop, so
+    recording is a dictionary update without locks."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+
+    @abstractmethod
+    def samples(self) -> Iterator[tuple[str, tuple[str, ...], float]]:
+        """Yields the name suffix, label values and value of every sample."""
+
+    def expose(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for suffix, labelvalues, value in self.samples():
+            names = self.labels + (("le",) if suffix == "_bucket" else ())
+            labels = _format_labels(names, labelvalues)
+            lines.append(f"{self.name}{suffix}{labels} {float(value)!r}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self) -> Iterator[tuple[str, tuple[str, ...], float]]:
+        for labelvalues, value in self._values.items():
+            yield "", labelvalues, value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labelvalues: str, amount: float = 1) -> None:
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, *labelvalues: str, value: float) -> None:
+        self._values[labelvalues] = value
+
+
+class Histogram(Metric):
+    """Counts observations in fixed buckets, exposed cumulatively like
+    Prometheus histograms so percentiles can be estimated from them."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        # count per bucket plus one for +Inf, then the sum of all observations
+        self._values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, *labelvalues: str, value: float) -> None:
+        counts = self._values.get(labelvalues)
+        if counts is None:
+            counts = self._values[labelvalues] = [0.0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self) -> Iterator[tuple[str, tuple[str, ...], float]]:
+        for labelvalues, counts in self._values.items():
+            cumulative = 0.0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                yield "_bucket", (*labelvalues, le), cumulative
+            yield "_sum", labelvalues, counts[-1]
+            yield "_count", labelvalues, cumulative
+
+
+class CallbackMetric(Metric):
+    """A metric read from a function when it is exposed, for values another
+    object already keeps, like the statistics of a cache. The function
+    returns the value of every combination of label values."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...],
+        read: Callable[[], dict[tuple[str, ...], float]],
+        kind: str = "gauge",
+    ):
+        super().__init__(name, documentation, labels)
+        self.read = read
+        self.kind = kind
+
+    def samples(self) -> Iterator[tuple[str, tuple[str, ...], float]]:
+        for labelvalues, value in self.read().items():
+            yield "", labelvalues, value
+
+
+M = TypeVar("M", bound=Metric)
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: M) -> M:
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        """Returns every metric in the Prometheus text format."""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+commands_total = registry.register(
+    Counter(
+        "memebot_commands_total",
+        "Commands run by outcome, ok, invalid input or error.",
+        ("command", "outcome"),
+    )
+)
+command_errors_total = registry.register(
+    Counter(
+        "memebot_command_errors_total",
+        "Exceptions raised in a phase of a command, by exception type. Phase "
+        "command counts exceptions the command did not handle.",
+        ("command", "phase", "exception"),
+    )
+)
+commands_in_flight = registry.register(
+    Gauge("memebot_commands_in_flight", "Commands currently running.", ("command",))
+)
+render_jobs_in_flight = registry.register(
+    Gauge("memebot_render_jobs_in_flight", "Jobs submitted to the render pool.")
+)
+command_duration_seconds = registry.register(
+    Histogram(
+        "memebot_command_duration_seconds",
+        "Time from invoking a command until it returns.",
+        ("command",),
+    )
+)
+command_phase_seconds = registry.register(
+    Histogram(
+        "memebot_command_phase_seconds",
+        "Time spent in each phase of a command.",
+        ("command", "phase"),
+    )
+)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Records the time spent in the with block as a phase of the running
+    command, and the type of any exception raised in it. The phase is also
+    traced as a span."""
+    command = current_command_name.get()
+    start = time.perf_counter()
+    try:
+        with span(name):
+            yield
+    except Exception as e:
+        command_errors_total.inc(command, name, type(e).__name__)
+        raise
+    finally:
+        command_phase_seconds.observe(command, name, value=time.perf_counter() - start)
+
+
+def set_outcome(outcome: str) -> None:
+    """Sets the outcome the running command is counted with.
+    Args:
+        outcome (str): "invalid" when the input was rejected, "error" when
+            the command failed."""
+    current_command_outcome.set(outcome)
+
+
+@contextmanager
+def track_command(command: str) -> Iterator[None]:
+    """Counts a command and records its duration and outcome."""
+    token = current_command_name.set(command)
+    outcome_token = current_command_outcome.set("ok")
+    commands_in_flight.inc(command)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        set_outcome("error")
+        command_errors_total.inc(command, "command", type(e).__name__)
+        raise
+    finally:
+        command_duration_seconds.observe(command, value=time.perf_counter() - start)
+        commands_total.inc(command, current_command_outcome.get())
+        commands_in_flight.dec(command)
+        current_command_outcome.reset(outcome_token)
+        current_command_name.reset(token)
+
+
+class MetricsServer:
+    """Serves the registry on /metrics over plain http, meant to be bound to
+    localhost and scraped by a local agent."""
+
+    def __init__(self, host: str, port: int, expose: Callable[[], str]) -> None:
+        self.host = host
+        self.port = port
+        self.expose = expose
+        self._runner: "web.AppRunner | None" = None
+
+    async def _handle(self, request: "web.Request") -> "web.Response":
+        from aiohttp import web
+
+        return web.Response(
+            body=self.expose().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    async def start(self) -> None:
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,369 @@
+import asyncio
+import importlib
+import multiprocessing
+import signal
+import traceback
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import TYPE_CHECKING, TypeVar
+
+from PIL import Image, ImageDraw, ImageFont
+
+from assets import get_font, get_image, load_image, preload
+from metrics import phase, render_jobs_in_flight
+from rendercache import render_cache
+from tracing import (
+    SpanRecord,
+    collect_spans,
+    current_profile,
+    current_span,
+    emit,
+    profile_to,
+    span,
+)
+
+# config imports discord.py, which the workers don't need
+if TYPE_CHECKING:
+    from config import RenderConfiguration
+
+# result of a job, the encoded output and sometimes its format
+R = TypeVar("R")
+
+# modules only the render workers use, imported by the jobs on first use so
+# the bot process doesn't load matplotlib and numpy while it starts
+WORKER_MODULES = ("caption", "charts", "dumpy", "gifs")
+
+
+class RenderExecutor:
+    """Runs CPU bound rendering jobs in a pool of worker processes so they
+    don't block the event loop.
+
+    Jobs are module level functions that take picklable arguments and return
+    the encoded output bytes, or a tuple of the bytes and details about them. After every worker has run about
+    max_tasks_per_child jobs the pool is replaced by a fresh one, so the
+    heaps of the workers don't keep growing. This is done here instead of
+    with ProcessPoolExecutor's max_tasks_per_child, which can deadlock."""
+
+    def __init__(self, config: "RenderConfiguration") -> None:
+        self.config = config
+        self._pool: ProcessPoolExecutor | None = None
+        self._submitted = 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        max_jobs = self.config.workers * self.config.max_tasks_per_child
+        if self._pool is not None and self._submitted >= max_jobs:
+            # the old workers finish their jobs and exit in the background
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        if self._pool is None:
+            # forking a process with running threads can deadlock
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.config.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=warm_worker,
+            )
+            self._submitted = 0
+        self._submitted += 1
+        return self._pool
+
+    async def submit(
+        self, job: Callable[..., R], *args, timeout: float | None = None
+    ) -> R:
+        """Runs a job in the pool and waits for its result.
+        Args:
+            job (Callable[..., R]): Module level function to run.
+            *args: Picklable arguments of the job.
+            timeout (float | None): Seconds the job may run once a worker
+            started it, defaults to the configured timeout.
+        Returns:
+            R: The output of the job, taken from the render cache when
+            called from a memoized command.
+        Raises:
+            TimeoutError: If the job ran longer than the timeout.
+            BrokenProcessPool: If a worker died while running the job."""
+        with phase("render"):
+            return await render_cache.memoized(
+                (job.__name__, *args), lambda: self._run(job, args, timeout)
+            )
+
+    async def _run(self, job: Callable[..., R], args: tuple, timeout) -> R:
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+        render_jobs_in_flight.inc()
+        context = (current_span.get(), current_profile.get())
+        try:
+            # the worker enforces the timeout itself from when the job starts,
+            # so time spent queued behind other jobs doesn't count, and a job
+            # that takes too long fails alone while its worker stays up
+            result, spans = await loop.run_in_executor(
+                pool,
+                traced_job,
+                context,
+                timeout or self.config.timeout,
+                job,
+                *args,
+            )
+            emit(spans)
+            return result
+        except BrokenProcessPool:
+            # a worker died, start a fresh pool for the next jobs
+            if self._pool is pool:
+                self._pool = None
+            pool.shutdown(wait=False)
+            raise
+        finally:
+            render_jobs_in_flight.dec()
+
+    async def warm_up(self) -> None:
+        """Starts every worker of the pool ahead of the first job."""
+        await asyncio.gather(
+            *(self.submit(warm_up_job) for _ in range(self.config.workers))
+        )
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+def warm_worker() -> None:
+    """Runs in every new worker, imports the modules of the jobs and loads
+    the plugins, images and fonts they use."""
+    try:
+        for module in WORKER_MODULES:
+            importlib.import_module(module)
+        from charts import DRAW_FUNCTIONS, render_chart
+        from dumpy import load_shader_lut
+
+        load_shader_lut()
+        # the first chart also builds the figure and loads matplotlib's fonts
+        for kind in DRAW_FUNCTIONS:
+            render_chart(kind, ["warm-up"], [1.0], "warm-up")
+        Image.init()
+        preload()
+        get_font(GRID_FONT_SIZE, encoding="unic")
+    except Exception as e:
+        # jobs load whatever failed again when they need it
+        print(e)
+        print(traceback.format_exc())
+
+
+def warm_up_job() -> bytes:
+    return b""
+
+
+@contextmanager
+def time_limit(seconds: float) -> Iterator[None]:
+    """Raises TimeoutError in the block once it ran for seconds. Workers run
+    jobs in their main thread, where the alarm signal is handled, between two
+    Python calls of the job."""
+
+    def expire(signum, frame) -> None:
+        raise TimeoutError(f"Render job took longer than {seconds} seconds")
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def traced_job(
+    context: tuple[tuple[str, str] | None, str | None],
+    timeout: float,
+    job: Callable[..., R],
+    *args,
+) -> tuple[R, list[SpanRecord]]:
+    """Runs a job in a worker as a span of the command that submitted it,
+    under cProfile when the command is profiled, and fails it with
+    TimeoutError after timeout seconds.
+    Returns:
+        tuple[R, list[SpanRecord]]: The output of the job and the spans
+        recorded while it ran."""
+    parent, profile = context
+    profile_path = f"{profile}-{job.__name__}.pstats" if profile else None
+    with collect_spans(parent) as spans, profile_to(profile_path):
+        with span(job.__name__), time_limit(timeout):
+            result = job(*args)
+    return result, spans
+
+
+def amogus_job(imagebytes: bytes, lines: int) -> bytes:
+    """Renders the amogus gif of an image."""
+    from dumpy import dumpy
+
+    with span("dumpy", lines=lines):
+        frames = dumpy(imagebytes, lines)
+    frame_one = frames[0]
+    with span("gif save", frames=len(frames)), BytesIO() as gif_binary:
+        frame_one.save(
+            gif_binary,
+            format="GIF",
+            append_images=frames,
+            save_all=True,
+            duration=100,
+            loop=0,
+            disposal=2,
+        )
+        return gif_binary.getvalue()
+
+
+def sotrue_job(image_bytes: bytes) -> bytes:
+    """Pastes an image into the so true template."""
+    img = get_image("images/sotrue.png")
+
+    img2 = load_image(image_bytes, (img.size[0] // 2 - 5, img.size[1] // 2 - 5), "RGBA")
+    img.paste(img2, (img.size[0] // 2 + 2, img.size[1] // 2 + 2))
+
+    with BytesIO() as image_binary:
+        img.save(image_binary, "PNG")
+        return image_binary.getvalue()
+
+
+def birthday_job(text: str) -> bytes:
+    """Writes a name on the birthday template."""
+    image_path = "images/Laser.jpg"
+    font_path = "uni.ttf"
+    angle = 35
+    img = get_image(image_path, "RGBA")
+    font_size = 35
+
+    # Load font
+    try:
+        if font_path:
+            font = get_font(font_size, font_path)
+        else:
+            font = ImageFont.load_default()
+    except OSError:
+        print(f"Warning: Could not load font from {font_path}. Using default font.")
+        font = ImageFont.load_default()
+
+    text_width = 20 * len(text)
+    text_height = 30
+    # Get font size
+    for font_size in range(35, 15, -1):
+        font = get_font(font_size, font_path)
+        # get bounding box
+        bbox = font.getbbox(text)
+        text_width = bbox[2] - bbox[0]
+        text_height = bbox[3] - bbox[1]
+
+        if text_width <= 145:
+            break
+
+    # create a blank image for text
+    x_size = text_width + 5
+    y_size = text_height + 20
+    txt_img = Image.new("RGBA", (x_size, y_size))
+    d = ImageDraw.Draw(txt_img)
+
+    # Draw text on the blank image
+    # Position the text at the center of the temporary image
+    # text_x = (x_size - text_width) / 2
+    # text_y = (y_size - text_height) / 2
+    d.text((0, 0), text, font=font, fill="black")
+
+    # Rotate the text image
+    rotated_txt_img = txt_img.rotate(
+        angle, expand=1, resample=Image.Resampling.BILINEAR
+    )
+
+    # bottom left coord
+    bl_coord = (-8, img.size[1] - 35)
+    # top left coord
+    tl_coord = (bl_coord[0], bl_coord[1] - rotated_txt_img.size[1])
+
+    img.paste(rotated_txt_img, tl_coord, rotated_txt_img)
+    with BytesIO() as image_binary:
+        img.save(image_binary, "PNG")
+        return image_binary.getvalue()
+
+
+GRID_TILE_SIZE = (300, 300)
+GRID_TITLE_HEIGHT = 50
+GRID_FONT_SIZE = 30
+
+
+def grid_tile_job(imgbytes: bytes, number: int) -> bytes:
+    """Decodes an image, scales it to a grid tile and numbers it.
+    Returns:
+        bytes: The raw RGB pixels of the tile."""
+    tile = load_image(imgbytes, GRID_TILE_SIZE)
+    font = get_font(GRID_FONT_SIZE, encoding="unic")
+    ImageDraw.Draw(tile).text((5, 5), str(number), font=font, embedded_color=True)
+    return tile.tobytes()
+
+
+def grid_job(title: str, tiles: list[bytes | None]) -> bytes:
+    """Arranges up to nine tiles in a grid below a title, missing tiles are
+    left gray."""
+    img_width, img_height = GRID_TILE_SIZE
+
+    rows = round(len(tiles) ** (1 / 2))
+    if rows**2 < len(tiles):
+        cols = rows + 1
+    else:
+        cols = rows
+
+    final_width = img_width * cols
+    final_height = img_height * rows + GRID_TITLE_HEIGHT
+
+    newimg = Image.new("RGB", (final_width, final_height), color="white")  # type: ignore
+    draw = ImageDraw.Draw(newimg)
+    font = get_font(GRID_FONT_SIZE, encoding="unic")
+
+    draw.text((5, 5), title, font=font, fill=(0, 0, 0))
+
+    for ii, tile in enumerate(tiles):
+        corner = (ii % cols) * img_width, (ii // cols) * img_height + GRID_TITLE_HEIGHT
+        if tile is None:
+            box = (*corner, corner[0] + img_width, corner[1] + img_height)
+            draw.rectangle(box, fill=(128, 128, 128))
+            draw.text((corner[0] + 5, corner[1] + 5), str(ii + 1), font=font)
+        else:
+            newimg.paste(Image.frombytes("RGB", GRID_TILE_SIZE, tile), corner)
+
+    with BytesIO() as image_binary:
+        newimg.save(image_binary, "PNG")
+        return image_binary.getvalue()
+
+
+def chart_job(kind: str, labels: list[str], values: list[float], title: str) -> bytes:
+    """Draws a pie, bar or line chart."""
+    from charts import render_chart
+
+    return render_chart(kind, labels, values, title)
+
+
+def reversegif_job(imgbytes: bytes) -> bytes:
+    """Plays a gif backwards."""
+    from gifs import reverse_gif
+
+    return reverse_gif(imgbytes)
+
+
+def apng2gif_job(imagebytes: bytes) -> bytes:
+    """Converts an animated png to a gif."""
+    from gifs import apng_to_gif
+
+    return apng_to_gif(imagebytes)
+
+
+def caption_job(imagebytes: bytes, text: str) -> tuple[bytes, str]:
+    """Writes top and bottom text on an image or gif, returns the image and
+    the format it was saved in."""
+    from caption import caption_image
+
+    return caption_image(imagebytes, text)
+
+
+def random_frame_job(imgbytes: bytes, reroll: bool = False) -> bytes:
+    """Picks a random frame of a gif as a png."""
+    from gifs import random_frame
+
+    return random_frame(imgbytes, reroll)
@@ -0,0 +1,107 @@
+import asyncio
+import hashlib
+from collections.abc import Awaitable, Callable
+from contextvars import ContextVar
+from typing import Any, TypeVar
+
+from attrs import define
+
+from utils import LRUCache
+
+# (command name, ttl) of the memoized command that is currently running
+current_command: ContextVar[tuple[str, float] | None] = ContextVar(
+    "current_command", default=None
+)
+
+
+T = TypeVar("T")
+
+
+@define
+class RenderCacheStats:
+    hits: int = 0
+    misses: int = 0
+
+
+def canonicalize(value) -> str:
+    """Turns command arguments into a stable string, input files are
+    represented by the hash of their content. Strings are kept exactly as
+    given, whitespace can change what a command renders."""
+    if isinstance(value, bytes | bytearray | memoryview):
+        return f"sha256:{hashlib.sha256(value).hexdigest()}"
+    if isinstance(value, str):
+        return repr(value)
+    if isinstance(value, list | tuple):
+        return "(" + ",".join(canonicalize(v) for v in value) + ")"
+    if isinstance(value, dict):
+        items = sorted((canonicalize(k), canonicalize(v)) for k, v in value.items())
+        return "{" + ",".join(f"{k}:{v}" for k, v in items) + "}"
+    return repr(value)
+
+
+def nbytes(value: Any) -> int:
+    """Size of a cached output, either encoded bytes or a tuple of the bytes
+    and details about them."""
+    if isinstance(value, tuple):
+        return sum(nbytes(part) for part in value)
+    return len(value)
+
+
+class RenderCache:
+    """LRU cache of encoded command outputs that expire after a ttl.
+    Evictions and expirations are counted by entries."""
+
+    def __init__(self, max_entries: int = 512, max_bytes: int = 128 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stats = RenderCacheStats()
+        self.entries: LRUCache[str, Any] = LRUCache(
+            max_entries=max_entries, max_size=max_bytes, sizeof=nbytes
+        )
+        self._pending: dict[str, asyncio.Future[Any]] = {}
+
+    def make_key(self, *parts) -> str:
+        return hashlib.sha256(canonicalize(parts).encode()).hexdigest()
+
+    async def memoized(self, parts: tuple, compute: Callable[[], Awaitable[T]]) -> T:
+        """Returns the cached result for parts when running inside a memoized
+        command, otherwise just awaits compute.
+
+        Concurrent calls with the same key share a single computation."""
+        command = current_command.get()
+        if command is None:
+            return await compute()
+
+        name, ttl = command
+        key = self.make_key(name, *parts)
+        value = self.entries.get(key)
+        if value is not None:
+            self.stats.hits += 1
+            return value
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.stats.hits += 1
+            return await asyncio.shield(pending)
+
+        self.stats.misses += 1
+        future: asyncio.Future[T] = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # the exception is raised here, don't warn if nobody else waited
+            future.exception()
+            raise
+        finally:
+            del self._pending[key]
+        future.set_result(value)
+        self.entries.put(key, value, ttl)
+        return value
+
+
+render_cache = RenderCache()
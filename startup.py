@@ -0,0 +1,69 @@
+import os
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from attrs import define
+
+
+def _process_start() -> float:
+    """Returns the perf_counter time the process was started at, so the
+    interpreter start and imports before this module are counted too. Falls
+    back to now where /proc is not available."""
+    now = time.perf_counter()
+    try:
+        with open("/proc/self/stat") as fp:
+            # the fields after the command name, starttime is the 22nd field
+            fields = fp.read().rsplit(")", 1)[1].split()
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        age = time.clock_gettime(time.CLOCK_BOOTTIME) - started
+    except (OSError, ValueError, IndexError, AttributeError):
+        return now
+    return now - max(age, 0)
+
+
+@define
+class Phase:
+    name: str
+    start: float
+    end: float
+
+
+class StartupTimeline:
+    """Records how long each phase of starting the bot took, reported in the
+    style of python -X importtime."""
+
+    def __init__(self) -> None:
+        self.start = _process_start()
+        self.phases: list[Phase] = []
+
+    def _last_end(self) -> float:
+        return max((phase.end for phase in self.phases), default=self.start)
+
+    def mark(self, name: str) -> None:
+        """Records a phase from the end of the previous phase until now."""
+        self.phases.append(Phase(name, self._last_end(), time.perf_counter()))
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Records the time spent in the with block as a phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append(Phase(name, start, time.perf_counter()))
+
+    def report(self) -> str:
+        lines = ["startup: offset [ms] | duration [ms] | phase"]
+        for phase in sorted(self.phases, key=lambda phase: phase.start):
+            lines.append(
+                f"startup: {(phase.start - self.start) * 1000:11.0f} | "
+                f"{(phase.end - phase.start) * 1000:13.0f} | {phase.name}"
+            )
+        lines.append(
+            f"startup: {0:11.0f} | {(self._last_end() - self.start) * 1000:13.0f} | total"
+        )
+        return "\n".join(lines)
+
+
+startup_timeline = StartupTimeline()
@@ -0,0 +1,259 @@
+import asyncio
+import re
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import msgspec
+
+from httpclient import http_client
+from utils import LRUCache, atomic_write_bytes
+
+TEMPLATES_URL = "https://api.memegen.link/templates"
+
+# discord shows at most 25 autocomplete choices
+MAX_CHOICES = 25
+# queries up to this length are answered from precomputed buckets
+BUCKET_PREFIX_LENGTH = 3
+
+
+class MemeTemplate(msgspec.Struct):
+    id: str
+    name: str
+    blank: str
+    lines: int = 2
+    keywords: list[str] = msgspec.field(default_factory=list)
+
+
+class CatalogFile(msgspec.Struct):
+    fetched_at: float
+    templates: list[MemeTemplate]
+
+
+def tokenize(text: str) -> list[str]:
+    """Splits text into lowercase alphanumeric tokens."""
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def trigrams(token: str) -> set[str]:
+    padded = f"  {token} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class TemplateCatalog:
+    """Local copy of the memegen template list with a search index.
+
+    The list is persisted to path and refreshed from the memegen api in the
+    background, so searching never waits on the network."""
+
+    def __init__(
+        self, path: str = "cache/templates.msgpack", refresh_interval: float = 6 * 3600
+    ) -> None:
+        self.path = Path(path)
+        self.refresh_interval = refresh_interval
+        self.templates: list[MemeTemplate] = []
+        self.fetched_at = 0.0
+        self._by_id: dict[str, MemeTemplate] = {}
+        self._tokens: list[dict[str, int]] = []
+        self._prefixes: dict[str, set[int]] = defaultdict(set)
+        self._trigrams: dict[str, set[str]] = defaultdict(set)
+        self._trigram_counts: dict[str, int] = {}
+        self._buckets: dict[str, list[int]] = {}
+        self._decoder = msgspec.json.Decoder(list[MemeTemplate])
+
+    def load(self) -> None:
+        """Loads the catalog saved by the last refresh."""
+        try:
+            catalog = msgspec.msgpack.decode(self.path.read_bytes(), type=CatalogFile)
+        except (FileNotFoundError, msgspec.DecodeError):
+            return
+        self._build(catalog.templates, catalog.fetched_at)
+
+    async def refresh(self) -> None:
+        """Downloads the template list and rebuilds the index."""
+        response = await http_client.get(TEMPLATES_URL)
+        response.raise_for_status()
+        templates = self._decoder.decode(response.content)
+        self._build(templates, time.time())
+        await asyncio.to_thread(self._save)
+
+    async def refresh_forever(self) -> None:
+        """Keeps the catalog up to date, meant to run as a background task."""
+        while True:
+            delay = self.fetched_at + self.refresh_interval - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Error refreshing meme templates: {e}")
+                await asyncio.sleep(60)
+
+    def _save(self) -> None:
+        catalog = CatalogFile(fetched_at=self.fetched_at, templates=self.templates)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_bytes(self.path, msgspec.msgpack.encode(catalog))
+
+    def _build(self, templates: list[MemeTemplate], fetched_at: float) -> None:
+        by_id = {}
+        tokens: list[dict[str, int]] = []
+        prefixes: dict[str, set[int]] = defaultdict(set)
+        trigram_index: dict[str, set[str]] = defaultdict(set)
+        trigram_counts: dict[str, int] = {}
+        for ii, template in enumerate(templates):
+            by_id[template.id] = template
+            # weight of each token, keywords count less than the name and id
+            weights: dict[str, int] = {}
+            for keyword in template.keywords:
+                for token in tokenize(keyword):
+                    weights[token] = 1
+            for token in tokenize(template.name) + tokenize(template.id):
+                weights[token] = 2
+            tokens.append(weights)
+            for token in weights:
+                for end in range(1, len(token) + 1):
+                    prefixes[token[:end]].add(ii)
+                token_trigrams = trigrams(token)
+                trigram_counts[token] = len(token_trigrams)
+                for trigram in token_trigrams:
+                    trigram_index[trigram].add(token)
+
+        # swap everything at once so searches never see a half built index
+        self.templates = templates
+        self.fetched_at = fetched_at
+        self._by_id = by_id
+        self._tokens = tokens
+        self._prefixes = prefixes
+        self._trigrams = trigram_index
+        self._trigram_counts = trigram_counts
+        self._buckets = self._build_buckets(templates, prefixes)
+
+    @staticmethod
+    def _build_buckets(
+        templates: list[MemeTemplate], prefixes: dict[str, set[int]]
+    ) -> dict[str, list[int]]:
+        """Precomputes the ordered completions of every short prefix, ids that
+        start with the prefix come before names that contain a matching word."""
+        buckets = {}
+        for prefix, indices in prefixes.items():
+            if len(prefix) > BUCKET_PREFIX_LENGTH:
+                continue
+            buckets[prefix] = sorted(
+                indices, key=lambda ii: (not templates[ii].id.startswith(prefix), ii)
+            )
+        return buckets
+
+    def get(self, template_id: str) -> MemeTemplate | None:
+        return self._by_id.get(template_id.strip())
+
+    def complete(self, current: str, limit: int = MAX_CHOICES) -> list[MemeTemplate]:
+        """Returns templates whose id or name starts with what the user typed,
+        falling back to a fuzzy search when nothing matches."""
+        current = current.strip().lower()
+        if not current:
+            return self.templates[:limit]
+
+        query = current.replace(" ", "-")
+        bucket = self._buckets.get(query[:BUCKET_PREFIX_LENGTH], [])
+        # short queries with a space, like "a a", have no bucket of their own
+        if len(query) <= BUCKET_PREFIX_LENGTH and bucket:
+            return [self.templates[ii] for ii in bucket[:limit]]
+
+        query_tokens = tokenize(current)
+        results = []
+        for ii in bucket:
+            template = self.templates[ii]
+            if template.id.startswith(query) or all(
+                any(t.startswith(q) for t in self._tokens[ii]) for q in query_tokens
+            ):
+                results.append(template)
+                if len(results) == limit:
+                    break
+        return results or self.search(current, limit)
+
+    def _similar_tokens(self, token: str) -> dict[str, float]:
+        """Finds indexed tokens that share most trigrams with token."""
+        query = trigrams(token)
+        counts: dict[str, int] = defaultdict(int)
+        for trigram in query:
+            for candidate in self._trigrams.get(trigram, ()):
+                counts[candidate] += 1
+        similar = {}
+        for candidate, shared in counts.items():
+            union = len(query) + self._trigram_counts[candidate] - shared
+            score = shared / union
+            if score >= 0.3:
+                similar[candidate] = score
+        return similar
+
+    def search(self, query: str, limit: int | None = None) -> list[MemeTemplate]:
+        """Ranks templates by how well their id, name and keywords match query.
+
+        Every word of the query has to match a token exactly, as a prefix or
+        approximately by trigram similarity."""
+        query_tokens = tokenize(query)
+        if not query_tokens:
+            return self.templates[:limit]
+
+        scores: dict[int, float] | None = None
+        for token in query_tokens:
+            token_scores: dict[int, float] = defaultdict(float)
+            for ii in self._prefixes.get(token, ()):
+                weights = self._tokens[ii]
+                if token in weights:
+                    score = 3.0 * weights[token]
+                else:
+                    score = 2.0 * max(
+                        w for t, w in weights.items() if t.startswith(token)
+                    )
+                token_scores[ii] = max(token_scores[ii], score)
+            for similar, similarity in self._similar_tokens(token).items():
+                for ii in self._prefixes.get(similar, ()):
+                    weight = self._tokens[ii].get(similar)
+                    if weight is not None:
+                        score = similarity * weight
+                        token_scores[ii] = max(token_scores[ii], score)
+
+            if scores is None:
+                scores = dict(token_scores)
+            else:
+                scores = {
+                    ii: score + token_scores[ii]
+                    for ii, score in scores.items()
+                    if ii in token_scores
+                }
+            if not scores:
+                return []
+
+        exact = self.get(query.lower().replace(" ", "-"))
+        ranked = sorted(scores, key=lambda ii: (-scores[ii], ii))  # type: ignore
+        results = [self.templates[ii] for ii in ranked]
+        if exact is not None:
+            results = [exact] + [t for t in results if t is not exact]
+        return results[:limit]
+
+
+class CompletionCache:
+    """Remembers the last completions of each user.
+
+    Discord sends an autocomplete request for every keystroke, repeated
+    requests of a user for the same text within ttl seconds reuse the
+    previous answer."""
+
+    def __init__(self, ttl: float = 5, max_users: int = 1000) -> None:
+        self.ttl = ttl
+        self.max_users = max_users
+        # query and completions by user id
+        self._entries: LRUCache[int, tuple[str, list]] = LRUCache(max_users, ttl=ttl)
+
+    def get(self, user_id: int, current: str) -> list | None:
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] != current:
+            return None
+        return entry[1]
+
+    def put(self, user_id: int, current: str, choices: list) -> None:
+        self._entries.put(user_id, (current, choices))
+
+
+template_catalog = TemplateCatalog()
@@ -0,0 +1,15 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# the bot's modules are flat files in the repository root
+sys.path.insert(0, str(ROOT))
+
+
+@pytest.fixture(autouse=True)
+def repo_root(monkeypatch: pytest.MonkeyPatch) -> None:
+    """The commands load their templates relative to the working directory."""
+    monkeypatch.chdir(ROOT)
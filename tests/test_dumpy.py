@@ -0,0 +1,63 @@
+from functools import cache
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from dumpy import dumpy, dumpy_reference
+
+
+def encode(img: Image.Image, format: str) -> bytes:
+    with BytesIO() as image_binary:
+        img.save(image_binary, format)
+        return image_binary.getvalue()
+
+
+def noise(size: tuple[int, int]) -> Image.Image:
+    rng = np.random.default_rng(size[0] * size[1])
+    return Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), np.uint8))
+
+
+def gradient(size: tuple[int, int]) -> Image.Image:
+    width, height = size
+    yy, xx = np.mgrid[0:height, 0:width]
+    pixels = np.stack(
+        [xx * 255 // width, yy * 255 // height, (xx + yy) * 127 // (width + height)],
+        axis=-1,
+    )
+    return Image.fromarray(pixels.astype(np.uint8))
+
+
+def transparent(size: tuple[int, int]) -> Image.Image:
+    img = gradient(size).convert("RGBA")
+    img.putalpha(Image.linear_gradient("L").resize(size))
+    return img
+
+
+IMAGES = {
+    "noise png": encode(noise((48, 32)), "PNG"),
+    "tall noise png": encode(noise((20, 60)), "PNG"),
+    "gradient jpeg": encode(gradient((64, 48)), "JPEG"),
+    "transparent png": encode(transparent((40, 40)), "PNG"),
+    "grey gif": encode(gradient((30, 30)).convert("L"), "GIF"),
+}
+
+
+@cache
+def reference_frames(name: str, lines: int) -> list[np.ndarray]:
+    """The per pixel renderer is slow, both modes compare against one run."""
+    frames = dumpy_reference(IMAGES[name], lines)
+    return [np.asarray(frame.convert("RGB")) for frame in frames]
+
+
+@pytest.mark.parametrize("name", IMAGES)
+# the range of lines /amogus accepts
+@pytest.mark.parametrize("lines", [10, 20, 30])
+@pytest.mark.parametrize("exact", [False, True])
+def test_dumpy_matches_reference(name: str, lines: int, exact: bool) -> None:
+    frames = dumpy(IMAGES[name], lines, exact=exact)
+    reference = reference_frames(name, lines)
+    assert len(frames) == len(reference)
+    for frame, expected in zip(frames, reference):
+        np.testing.assert_array_equal(np.asarray(frame), expected)
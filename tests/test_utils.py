@@ -0,0 +1,70 @@
+from pathlib import Path
+
+import pytest
+
+from utils import LRUCache, atomic_open, atomic_write_bytes, with_format_suffix
+
+
+def test_lru_cache_evicts_least_recently_used() -> None:
+    evicted = []
+    cache: LRUCache[str, int] = LRUCache(
+        max_entries=2, on_evict=lambda key, value: evicted.append(key)
+    )
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert evicted == ["b"]
+    assert cache.get("a") == 1 and cache.get("b") is None and cache.get("c") == 3
+
+
+def test_lru_cache_limits_size() -> None:
+    cache: LRUCache[str, bytes] = LRUCache(max_size=10)
+    cache.put("a", b"x" * 6)
+    cache.put("b", b"y" * 6)
+    assert "a" not in cache and cache.size == 6
+    # values that don't fit at all are not stored
+    cache.put("c", b"z" * 11)
+    assert "c" not in cache and "b" in cache
+
+
+def test_lru_cache_expires_entries(monkeypatch: pytest.MonkeyPatch) -> None:
+    now = 100.0
+    monkeypatch.setattr("utils.time.monotonic", lambda: now)
+    cache: LRUCache[str, int] = LRUCache(ttl=10)
+    cache.put("a", 1)
+    cache.put("b", 2, ttl=30)
+    now = 120.0
+    assert cache.get("a") is None and cache.get("b") == 2
+    assert cache.expirations == 1 and len(cache) == 1
+
+
+def test_atomic_write_bytes(tmp_path: Path) -> None:
+    path = tmp_path / "file.bin"
+    atomic_write_bytes(path, b"old")
+    atomic_write_bytes(path, b"new")
+    assert path.read_bytes() == b"new"
+    assert [p.name for p in tmp_path.iterdir()] == ["file.bin"]
+
+
+def test_atomic_open_keeps_file_on_error(tmp_path: Path) -> None:
+    path = tmp_path / "file.bin"
+    path.write_bytes(b"old")
+    with pytest.raises(RuntimeError):
+        with atomic_open(path) as fp:
+            fp.write(b"half")
+            raise RuntimeError
+    assert path.read_bytes() == b"old"
+    assert [p.name for p in tmp_path.iterdir()] == ["file.bin"]
+
+
+@pytest.mark.parametrize(
+    "filename, image_format, expected",
+    [
+        ("meme.jpg", "JPEG", "meme.jpg"),
+        ("meme.webp", "GIF", "meme.gif"),
+        ("meme.bmp", "PNG", "meme.png"),
+    ],
+)
+def test_with_format_suffix(filename: str, image_format: str, expected: str) -> None:
+    assert with_format_suffix(filename, image_format) == expected
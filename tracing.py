@@ -0,0 +1,193 @@
+import cProfile
+import inspect
+import logging
+import os
+import queue
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+from typing import Any
+
+import msgspec
+
+from mediacache import MB
+
+
+class SpanRecord(msgspec.Struct):
+    """A finished span, one line of the spans file."""
+
+    trace: str
+    span: str
+    parent: str | None
+    name: str
+    start: float
+    duration: float
+    pid: int
+    attributes: dict[str, Any] = {}
+    error: str | None = None
+
+
+# trace and span id of the innermost open span
+current_span: ContextVar[tuple[str, str] | None] = ContextVar(
+    "current_span", default=None
+)
+
+# path prefix of the .pstats files when the running command is profiled
+current_profile: ContextVar[str | None] = ContextVar("current_profile", default=None)
+
+# where finished spans go, nothing is recorded until a sink is set
+_sink: Callable[[SpanRecord], None] | None = None
+
+
+class span:
+    """Times a with block, or every call of a decorated function, as a span
+    nested in the span that was open when it started.
+
+    with span("gif save", frames=len(frames)):
+        ...
+
+    @span("download")
+    async def download(...):
+        ..."""
+
+    def __init__(self, name: str, **attributes: Any) -> None:
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self) -> "span":
+        parent = current_span.get()
+        self._parent = parent[1] if parent else None
+        self._trace = parent[0] if parent else os.urandom(8).hex()
+        self._id = os.urandom(8).hex()
+        self._token = current_span.set((self._trace, self._id))
+        self._start = time.time()
+        self._perf_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        current_span.reset(self._token)
+        if _sink is None:
+            return
+        _sink(
+            SpanRecord(
+                trace=self._trace,
+                span=self._id,
+                parent=self._parent,
+                name=self.name,
+                start=self._start,
+                duration=time.perf_counter() - self._perf_start,
+                pid=os.getpid(),
+                attributes=self.attributes,
+                error=exc_type.__name__ if exc_type is not None else None,
+            )
+        )
+
+    def __call__(self, func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(self.name, **self.attributes):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(self.name, **self.attributes):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+class SpanWriter:
+    """Appends finished spans to a rotating JSONL file. Lines are written by
+    a background thread, so recording a span never waits for the disk."""
+
+    def __init__(
+        self, path: str = "logs/spans.jsonl", max_bytes: int = 10 * MB, backups: int = 5
+    ) -> None:
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+        self._logger = logging.getLogger("memebot.spans")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        self._handler = QueueHandler(self._queue)
+        self._listener: QueueListener | None = None
+
+    def write(self, record: SpanRecord) -> None:
+        self._logger.info(msgspec.json.encode(record).decode())
+
+    def start(self) -> None:
+        """Opens the file and sends every span recorded from now on to it."""
+        global _sink
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        handler = RotatingFileHandler(
+            self.path, maxBytes=self.max_bytes, backupCount=self.backups
+        )
+        self._logger.addHandler(self._handler)
+        self._listener = QueueListener(self._queue, handler)
+        self._listener.start()
+        _sink = self.write
+
+    def stop(self) -> None:
+        global _sink
+        if self._listener is None:
+            return
+        _sink = None
+        self._logger.removeHandler(self._handler)
+        self._listener.stop()
+        for handler in self._listener.handlers:
+            handler.close()
+        self._listener = None
+
+
+def emit(records: list[SpanRecord]) -> None:
+    """Records spans that were finished in another process."""
+    if _sink is not None:
+        for record in records:
+            _sink(record)
+
+
+@contextmanager
+def collect_spans(parent: tuple[str, str] | None) -> Iterator[list[SpanRecord]]:
+    """Collects the spans finished in the with block into a list instead of
+    the sink, nested in parent. Used by render workers, which send their
+    spans back with the result of the job."""
+    global _sink
+    records: list[SpanRecord] = []
+    previous, _sink = _sink, records.append
+    token = current_span.set(parent)
+    try:
+        yield records
+    finally:
+        current_span.reset(token)
+        _sink = previous
+
+
+@contextmanager
+def profile_to(path: str | None) -> Iterator[None]:
+    """Runs the with block under cProfile and dumps the stats to path, does
+    nothing if path is None or another profile is already running."""
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # only one profiler can be active in a thread
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(path)
@@ -1,57 +1,134 @@
-import random
-from io import BytesIO
-from urllib.parse import urlparse
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Generic, TypeVar
 
-import httpx2
 from PIL import Image
 
-
-async def memerequest(background: str, text: str) -> bytes:
-    """Sends a request to the meme generation API and returns the image bytes.
-
-    Args:
-        background (str): The background image URL or identifier.
-        text (str): The text to overlay on the meme, separated by commas for multiple lines
-
-    Returns:
-        bytes: The generated meme image in bytes.
-    """
-    baseurl = "https://api.memegen.link/images/custom"
-    payload_text = [x.strip() for x in text.split(",")]
-    payload = {"background": background, "text": payload_text}
-
-    async with httpx2.AsyncClient() as client:
-        req = await client.post(url=baseurl, data=payload)
-        response = req.json()
-        meme_url = response["url"]
-        # only bottom text case
-        if payload_text[0] == "":
-            meme_text = urlparse(meme_url).path.split("/")[-1]
-            meme_url = meme_url.replace(meme_text, f"_/{meme_text}")
-
-        resp = await client.get(meme_url)
-        return resp.content
-
-
-def seekrandomframe(imgbytes: bytes) -> BytesIO:
-    """Selects a random frame from a GIF image and returns it as a PNG in a BytesIO object.
-    Args:
-        imgbytes (bytes): The bytes of the GIF image.
-    Returns:
-        BytesIO: A BytesIO object containing the PNG image of the selected frame."""
-    gif = Image.open(BytesIO(imgbytes))
-    num_frames = getattr(gif, "n_frames", 1)
-    # select random frame
-    rand_frame = random.randint(0, num_frames - 1)
-    gif.seek(rand_frame)
-    # send final image
-    image_binary = BytesIO()
-    gif.save(image_binary, "PNG")
-    image_binary.seek(0)
-    return image_binary
+K = TypeVar("K")
+V = TypeVar("V")
 
 
 def clean_str(filename: str) -> str:
     """Cleans a string so that it can be used as a filename."""
     filename_clean = filename.replace(" ", "_")
     return "".join(filter(str.isalnum, filename_clean))
+
+
+def with_format_suffix(filename: str, image_format: str) -> str:
+    """Replaces the extension of a filename by the one of an image format,
+    for outputs that were saved in another format than their input."""
+    path = Path(filename)
+    if Image.registered_extensions().get(path.suffix.lower()) == image_format:
+        return filename
+    return str(path.with_suffix(f".{image_format.lower()}"))
+
+
+@contextmanager
+def atomic_open(path: str | os.PathLike) -> Iterator[IO[bytes]]:
+    """Opens a temporary file next to path for writing, which replaces path
+    when the with block finishes. Readers never see a half written file, and
+    nothing is replaced if the block raises.
+
+    Temporary files end in .tmp, directories of cached files skip them."""
+    path = Path(path)
+    # unique per process and thread, writers of the same file don't collide
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, "wb") as fp:
+            yield fp
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def atomic_write_bytes(path: str | os.PathLike, data: bytes) -> None:
+    """Replaces the content of path with data, see atomic_open."""
+    with atomic_open(path) as fp:
+        fp.write(data)
+
+
+class LRUCache(Generic[K, V]):
+    """Keeps the most recently used entries, at most max_entries of them
+    and at most max_size by the size of their values. Entries expire after
+    ttl seconds if a ttl is given.
+
+    Sizes are measured with sizeof, only when max_size is set. Values bigger
+    than max_size are not stored. on_evict is called with the key and value
+    of every entry evicted to make room."""
+
+    def __init__(
+        self,
+        max_entries: int | None = None,
+        max_size: int | None = None,
+        ttl: float | None = None,
+        sizeof: Callable[[V], int] = len,  # type: ignore
+        on_evict: Callable[[K, V], None] | None = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.size = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] >= time.monotonic()
+
+    def get(self, key: K) -> V | None:
+        """Returns the value of key and marks it as recently used, or None if
+        it is missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self.pop(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: K, value: V, ttl: float | None = None) -> None:
+        """Stores value as the most recently used entry, expiring after ttl
+        seconds, or the ttl of the cache if None."""
+        size = self._sizeof(value)
+        if self.max_size is not None and size > self.max_size:
+            return
+        self.pop(key)
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = math.inf if ttl is None else time.monotonic() + ttl
+        self._entries[key] = (expires_at, value)
+        self.size += size
+        while (self.max_entries is not None and len(self) > self.max_entries) or (
+            self.max_size is not None and self.size > self.max_size
+        ):
+            evicted = next(iter(self._entries))
+            evicted_value = self.pop(evicted)
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(evicted, evicted_value)  # type: ignore
+
+    def pop(self, key: K) -> V | None:
+        """Removes key and returns its value, expired or not."""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        self.size -= self._sizeof(entry[1])
+        return entry[1]
+
+    def _sizeof(self, value: V) -> int:
+        return self.sizeof(value) if self.max_size is not None else 0